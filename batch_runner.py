@@ -0,0 +1,253 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import time
+try:
+    import tomllib
+except ImportError:  # Python < 3.11 reads JSON experiment files only
+    tomllib = None
+import gerrychainGA as ga
+import sb_runs
+from gingleator import Gingleator
+from plan_archive import PlanArchive
+
+GRAPH_PATH = "./GA_clean.json"
+NUM_WORKERS = None  # Pool size for the short burst jobs; None uses every core, 1 runs them in sequence
+
+# Module whose constants an experiment of each kind overrides
+MODULES = {"ensemble": ga, "short_burst": sb_runs}
+# Settings holding paths, which are formatted with the experiment's name and
+# its other settings, e.g. "./output/batch/{name}/eps{EPS}"
+PATH_SETTINGS = ["ENSEMBLE_DIR", "FIGURE_DIR", "OUT_DIR", "TRACK_DIR", "ARCHIVE_DIR", "MANIFEST_FILE"]
+
+# The graph, elections and initial partitions every experiment shares, loaded
+# once by load_shared. Forked workers inherit them instead of loading them again.
+_shared = {}
+
+
+def load_experiments(path):
+    """
+    Reads an experiment file, in TOML or JSON by its extension:
+
+        graph = "./GA_clean.json"   # optional
+        workers = 4                 # optional
+
+        [[experiments]]
+        name = "tolerance-10"
+        kind = "ensemble"           # overrides gerrychainGA constants
+        [experiments.settings]
+        NUM_STEPS = [1000, 5000]
+        POPULATION_TOLERANCE = 0.1
+        ENSEMBLE_DIR = "./output/batch/{name}/ensemble"
+        FIGURE_DIR = "./output/batch/{name}"
+
+        [[experiments]]
+        name = "bursts-eps045"
+        kind = "short_burst"        # overrides sb_runs constants
+        [experiments.settings]
+        BURST_LENS = [10, 25]
+        THRESHOLDS = [0.4]
+        EPS = 0.045
+        SCORE_FUNCT = "num_opportunity_dists"
+        OUT_DIR = "./output/batch/{name}"
+
+    Each experiment's settings override the module constants of the same
+    name for that experiment only.
+    """
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise RuntimeError("TOML experiment files need Python 3.11 or later; use JSON")
+        with open(path, "rb") as f_in:
+            config = tomllib.load(f_in)
+    else:
+        with open(path) as f_in:
+            config = json.load(f_in)
+
+    for i, experiment in enumerate(config.get("experiments", [])):
+        experiment.setdefault("name", "experiment{}".format(i))
+        if experiment.get("kind") not in MODULES:
+            raise ValueError("Experiment {} has kind {!r}, not one of {}".format(
+                experiment["name"], experiment.get("kind"), list(MODULES)))
+        experiment["settings"] = resolve_settings(experiment)
+    return config
+
+
+def resolve_settings(experiment):
+    """
+    Returns an experiment's settings as module constants: checked against the
+    module, with score functions looked up by name and paths formatted. A
+    short burst experiment that moves OUT_DIR gets its other output paths
+    under it, as sb_runs lays them out.
+    """
+    module = MODULES[experiment["kind"]]
+    raw = experiment.get("settings", {})
+    unknown = [name for name in raw if not hasattr(module, name)]
+    if unknown:
+        raise ValueError("{} has no settings {}".format(module.__name__, unknown))
+
+    fields = dict(raw, name=experiment["name"])
+    settings = {}
+    for name, value in raw.items():
+        if name in PATH_SETTINGS:
+            try:
+                value = value.format(**fields)
+            except KeyError as error:
+                raise ValueError("Experiment {} setting {} refers to {{{}}}, which is not one of "
+                                 "its settings".format(experiment["name"], name, error.args[0])
+                                 ) from None
+        settings[name] = value
+    if isinstance(settings.get("SCORE_FUNCT"), str):
+        settings["SCORE_FUNCT"] = getattr(Gingleator, settings["SCORE_FUNCT"])
+    if experiment["kind"] == "short_burst" and "OUT_DIR" in settings:
+        out_dir = settings["OUT_DIR"]
+        settings.setdefault("TRACK_DIR", "{}/thresholds".format(out_dir))
+        settings.setdefault("ARCHIVE_DIR", "{}/plans".format(out_dir))
+        settings.setdefault("MANIFEST_FILE", "{}/manifest.json".format(out_dir))
+    return settings
+
+
+@contextlib.contextmanager
+def overridden(module, settings):
+    """
+    Sets module constants for the duration of a with block.
+    """
+    saved = {name: getattr(module, name) for name in settings}
+    for name, value in settings.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+
+def load_shared(graph_path, experiments):
+    """
+    Loads the graph and builds the elections and initial partitions (with
+    their updaters) once for every experiment: gerrychainGA's and sb_runs'
+    for each POP_COL the experiments of that kind use.
+    """
+    graph = ga.load_graph(graph_path)
+    elections = ga.build_elections()
+    _shared["graph"] = graph
+    _shared["elections"] = elections
+    _shared["experiments"] = experiments
+    _shared["ensemble_partitions"] = {}
+    _shared["sb_partitions"] = {}
+    for experiment in experiments:
+        if experiment["kind"] == "ensemble":
+            pop_col = experiment["settings"].get("POP_COL", ga.POP_COL)
+            if pop_col not in _shared["ensemble_partitions"]:
+                with overridden(ga, {"POP_COL": pop_col}):
+                    _shared["ensemble_partitions"][pop_col] = ga.initialize_partition(elections, graph)
+        else:
+            pop_col = experiment["settings"].get("POP_COL", sb_runs.POP_COL)
+            if pop_col not in _shared["sb_partitions"]:
+                with overridden(sb_runs, {"POP_COL": pop_col}):
+                    _shared["sb_partitions"][pop_col] = sb_runs.build_initial_partition(graph)
+
+
+def run_ensemble_experiment(experiment):
+    """
+    Runs an ensemble experiment in this process from the shared partition.
+    Its chains and figures use their own process pools.
+    """
+    with overridden(ga, experiment["settings"]):
+        ga.run_ensembles(_shared["ensemble_partitions"][ga.POP_COL], _shared["elections"],
+                         _shared["graph"])
+
+
+def short_burst_jobs(index, experiment):
+    """
+    Sets up a short burst experiment's output directories, manifest and plan
+    archive as sb_runs.main does, and returns its archive and its unfinished
+    jobs tagged with the experiment's index.
+    """
+    with overridden(sb_runs, experiment["settings"]):
+        os.makedirs(sb_runs.OUT_DIR, exist_ok=True)
+        if sb_runs.TRACK_THRESHOLDS:
+            os.makedirs(sb_runs.TRACK_DIR, exist_ok=True)
+        jobs = sb_runs.build_job_manifest()
+        with open(sb_runs.MANIFEST_FILE, "w") as f_out:
+            json.dump(jobs, f_out, indent=2)
+
+        partition = _shared["sb_partitions"][sb_runs.POP_COL]
+        archive = PlanArchive(sb_runs.ARCHIVE_DIR, nodes=partition.graph.nodes,
+                              labels=sorted(partition.parts.keys()))
+        pending = [(index, job) for job in jobs if not sb_runs.job_done(job, archive)]
+    return archive, pending
+
+
+def _run_short_burst(unit):
+    index, job = unit
+    experiment = _shared["experiments"][index]
+    with overridden(sb_runs, experiment["settings"]):
+        sb_runs.initial_partition = _shared["sb_partitions"][sb_runs.POP_COL]
+        return index, sb_runs.run_job(job)
+
+
+def run_batch(config, num_workers=NUM_WORKERS):
+    """
+    Runs every experiment of a loaded experiment file from one shared graph
+    and set of partitions. Ensemble experiments run one after another in
+    this process. The jobs of every short burst experiment then run together,
+    in sequence or on a pool of num_workers forked processes, and their best
+    plans are archived per experiment as sb_runs.main does. Finished short
+    burst jobs are skipped, so an interrupted batch can be rerun.
+    """
+    graph_path = config.get("graph", GRAPH_PATH)
+    experiments = config.get("experiments", [])
+    start_time = time.time()
+    load_shared(graph_path, experiments)
+    print("Loaded graph and partitions in {:.1f}s".format(time.time() - start_time), flush=True)
+
+    archives, pending = {}, []
+    for index, experiment in enumerate(experiments):
+        if experiment["kind"] == "ensemble":
+            print("Running ensemble experiment {}".format(experiment["name"]), flush=True)
+            run_ensemble_experiment(experiment)
+        else:
+            archives[index], jobs = short_burst_jobs(index, experiment)
+            pending.extend(jobs)
+
+    if not pending:
+        return
+    print("Running {} short burst jobs".format(len(pending)), flush=True)
+
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    with contextlib.ExitStack() as stack:
+        if num_workers > 1:
+            pool = stack.enter_context(
+                multiprocessing.get_context("fork").Pool(min(num_workers, len(pending))))
+            results = pool.imap_unordered(_run_short_burst, pending)
+        else:
+            results = map(_run_short_burst, pending)
+
+        for index, (job, plans, labels) in results:
+            experiment = experiments[index]
+            with overridden(sb_runs, experiment["settings"]):
+                if archives[index].find_run(**sb_runs.run_key(job)) is None:
+                    archives[index].add_run(sb_runs.run_key(job), plans, labels)
+            print("\tFinished {} chain {} (burst length {}, threshold {}): {} distinct plans in {} steps"
+                  .format(experiment["name"], job["n"], job["burst_len"], job["threshold"],
+                          job["distinct_plans"], job["steps"]), flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch of ensemble and short burst experiments.")
+    parser.add_argument("experiments", help="experiment file (.toml or .json)")
+    parser.add_argument("--graph", help="graph JSON (default: the file's graph or GA_clean.json)")
+    parser.add_argument("--workers", type=int, help="pool size for short burst jobs (1: in sequence)")
+    args = parser.parse_args()
+
+    config = load_experiments(args.experiments)
+    if args.graph is not None:
+        config["graph"] = args.graph
+    run_batch(config, args.workers if args.workers is not None else config.get("workers", NUM_WORKERS))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+import warnings
+from functools import partial
+import numpy as np
+from gerrychain import Graph, MarkovChain, constraints, accept
+from gerrychain.proposals import recom
+from gerrychain.tree import BipartitionWarning
+import sb_runs
+import graph_cache
+import gerrychainGA as ga
+from fast_recom import fast_recom
+from gingleator import Gingleator, config_markov_chain
+
+GRAPH_PATH = "./GA_clean.json"
+NUM_BURSTS = 320  # Bursts per sample of an 8000 step run with burst length 25
+SEED = 0  # Every benchmark reseeds random and np.random with this first
+BASELINE_FILE = "./benchmarks.json"
+TOLERANCE = 0.2  # Relative slowdown from the baseline reported as a regression
+
+# Modules chain workers import, which must not pull in plotting libraries
+HEADLESS_MODULES = ["gerrychainGA", "gingleator", "sb_runs", "parallel_ensemble", "convergence",
+                    "batch_runner"]
+PLOTTING_MODULES = ["matplotlib", "seaborn"]
+
+SCORE_FUNCTS = ["num_opportunity_dists", "reward_partial_dist", "reward_next_highest_close",
+                "penalize_maximum_over", "penalize_avg_over"]
+
+
+def seed_all(seed=SEED):
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def result(value, unit):
+    """
+    Returns one benchmark result. Units ending in "/s" are rates, where higher
+    is better; all others are times, where lower is better.
+    """
+    return {"value": value, "unit": unit}
+
+
+def setup_gingleator(graph_path=GRAPH_PATH):
+    initial_partition = sb_runs.build_initial_partition(graph_cache.load_graph(graph_path))
+    gingles = Gingleator(initial_partition, pop_col=sb_runs.POP_COL, threshold=0.4,
+                         epsilon=sb_runs.EPS, minority_perc_col="BVAP_perc")
+    gingles.init_minority_perc_col("BVAP", "VAP", "BVAP_perc")
+    return gingles
+
+
+def bench_burst_setup(gingles, num_bursts=NUM_BURSTS, burst_len=25):
+    """
+    Returns the seconds per burst spent setting up the burst's chain, with
+    config_markov_chain and with the Gingleator's BurstEngine. Only the setup
+    is timed, not the ReCom steps.
+    """
+    start = time.perf_counter()
+    for _ in range(num_bursts):
+        config_markov_chain(gingles.part, iters=burst_len, epsilon=gingles.epsilon,
+                            pop=gingles.pop_col)
+    config_time = (time.perf_counter() - start) / num_bursts
+
+    start = time.perf_counter()
+    for _ in range(num_bursts):
+        gingles.burst_engine.run(gingles.part, burst_len)
+    engine_time = (time.perf_counter() - start) / num_bursts
+
+    return {"config_markov_chain": config_time, "burst_engine": engine_time}
+
+
+def bench_recom_steps(partition, num_steps=50, epsilon=sb_runs.EPS, pop_col=sb_runs.POP_COL):
+    """
+    Returns the ReCom steps per second of gerrychain's recom and of fast_recom
+    on a chain from partition, including the partition's updaters.
+    """
+    pop_target = sum(partition["population"].values()) / len(partition)
+    results = {}
+    for name, proposal in [("recom", recom), ("fast_recom", fast_recom)]:
+        chain = MarkovChain(partial(proposal, pop_col=pop_col, pop_target=pop_target,
+                                    epsilon=epsilon, node_repeats=1),
+                            [constraints.within_percent_of_ideal_population(partition, epsilon)],
+                            accept.always_accept, partition, num_steps)
+        start = time.perf_counter()
+        for _ in chain:
+            pass
+        results[name] = num_steps / (time.perf_counter() - start)
+    return results
+
+
+def bench_graph_load(graph_path=GRAPH_PATH, repeats=3):
+    """
+    Returns the best of repeats load times of the graph, from its JSON with
+    gerrychain and from the graph cache (built first if missing).
+    """
+    graph_cache.load_graph(graph_path)
+    results = {}
+    for name, load in [("graph_from_json", Graph.from_json), ("graph_cache", graph_cache.load_graph)]:
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            load(graph_path)
+            times.append(time.perf_counter() - start)
+        results[name] = result(min(times), "s")
+    return results
+
+
+def bench_initialize_partition(graph, elections, repeats=3):
+    """
+    Returns the best of repeats times to build gerrychainGA's initial
+    partition and compute its stats once, as the first step of a walk does.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        partition = ga.initialize_partition(elections, graph)
+        ga.get_plan_stats_row(partition, [election.name for election in elections])
+        times.append(time.perf_counter() - start)
+    return {"initialize_partition": result(min(times), "s")}
+
+
+def bench_random_walk(initial_partition, graph, elections, num_steps=200):
+    """
+    Walks execute_random_walk's chain, as gerrychainGA.py sets it up, for
+    num_steps steps and returns its steps per second along with the mean time
+    per step of get_plan_stats (one election) and of get_plan_stats_row
+    (every election), which are timed separately from the walk.
+    """
+    seed_all()
+    election_names = [election.name for election in elections]
+    random_walk = ga.execute_random_walk(initial_partition, num_steps, ga.NUM_GA_DISTS, graph)
+
+    walk_time = plan_stats_time = stats_row_time = 0.0
+    start = time.perf_counter()
+    for partition in random_walk:
+        walk_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        ga.get_plan_stats(ga.new_data_dict(), partition, election_names[0])
+        plan_stats_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        ga.get_plan_stats_row(partition, election_names)
+        stats_row_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+
+    return {"random_walk": result(num_steps / walk_time, "steps/s"),
+            "get_plan_stats": result(plan_stats_time / num_steps, "s"),
+            "get_plan_stats_row": result(stats_row_time / num_steps, "s")}
+
+
+def check_random_walk(graph, elections, num_steps=20):
+    """
+    Regression run of execute_random_walk with its default arguments, as
+    gerrychainGA.py runs it. Returns the error the chain raised within
+    num_steps steps, or None. A proposal that needs 1000 tries to find a
+    balanced cut counts as failing, rather than trying on to its limit.
+    """
+    seed_all()
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", BipartitionWarning)
+            for _ in ga.execute_random_walk(ga.initialize_partition(elections, graph), num_steps,
+                                            ga.NUM_GA_DISTS, graph):
+                pass
+    except Exception as error:
+        return error
+    return None
+
+
+def bench_score_functions(gingles, num_plans=200, repeats=5):
+    """
+    Returns the mean time per call of each Gingleator score function over the
+    plans of a short chain from the Gingleator's initial plan, best of
+    repeats passes. Each plan's minority percentages are computed before
+    timing, so only the scoring is timed.
+    """
+    seed_all()
+    plans = list(gingles.burst_engine.run(gingles.part, num_plans))
+    for part in plans:
+        Gingleator.dist_percs(part, gingles.minority_perc)
+
+    results = {}
+    for name in SCORE_FUNCTS:
+        score_fn = getattr(Gingleator, name)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for part in plans:
+                score_fn(part, gingles.minority_perc, gingles.threshold)
+            times.append(time.perf_counter() - start)
+        results[f"score_{name}"] = result(min(times) / len(plans), "s")
+    return results
+
+
+def bench_short_burst_run(gingles, num_bursts=10, num_steps=25):
+    """
+    Returns the wall-clock time of a short short_burst_run.
+    """
+    seed_all()
+    start = time.perf_counter()
+    gingles.short_burst_run(num_bursts=num_bursts, num_steps=num_steps)
+    return {"short_burst_run": result(time.perf_counter() - start, "s")}
+
+
+def import_time(module, repeats=3):
+    """
+    Returns the best of repeats cumulative import times of module, in seconds,
+    from python -X importtime in a fresh interpreter (as a spawned worker
+    starts), along with the plotting modules the import loaded.
+    """
+    code = "import sys, {}; print(*[m for m in {!r} if m in sys.modules])".format(module,
+                                                                                 PLOTTING_MODULES)
+    times = []
+    for _ in range(repeats):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                              capture_output=True, text=True, check=True)
+        for line in proc.stderr.splitlines():
+            fields = line.split("|")
+            if len(fields) == 3 and fields[2].strip() == module:
+                times.append(int(fields[1]) / 1e6)
+    return min(times), proc.stdout.split()
+
+
+def bench_imports(modules=HEADLESS_MODULES):
+    """
+    Returns the import time of each module chain workers import, and the
+    plotting modules each one loaded (which should be none).
+    """
+    results, plotting = {}, {}
+    for module in modules:
+        seconds, loaded = import_time(module)
+        results[f"import_{module}"] = result(seconds, "s")
+        if loaded:
+            plotting[module] = loaded
+    return results, plotting
+
+
+def run_suite(graph_path=GRAPH_PATH):
+    """
+    Runs every benchmark against graph_path with fixed seeds and returns the
+    results by name. Raises RuntimeError if the default ensemble walk fails
+    its regression run.
+    """
+    results = bench_graph_load(graph_path)
+
+    graph = ga.load_graph(graph_path)
+    elections = ga.build_elections()
+    error = check_random_walk(graph, elections)
+    if error is not None:
+        raise RuntimeError(f"execute_random_walk fails with its default arguments: {error!r}")
+    results.update(bench_initialize_partition(graph, elections))
+    results.update(bench_random_walk(ga.initialize_partition(elections, graph), graph, elections))
+
+    gingles = setup_gingleator(graph_path)
+    results.update(bench_score_functions(gingles))
+    results.update(bench_short_burst_run(gingles))
+
+    seed_all()
+    for name, seconds in bench_burst_setup(gingles).items():
+        results[f"burst_setup_{name}"] = result(seconds, "s")
+    seed_all()
+    for name, steps_per_sec in bench_recom_steps(gingles.part).items():
+        results[f"steps_{name}"] = result(steps_per_sec, "steps/s")
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Returns (name, baseline value, value, relative change) for every result
+    more than tolerance slower than its baseline. A positive change is a
+    slowdown, whether the result is a time or a rate.
+    """
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        old, new = baseline[name]["value"], res["value"]
+        if res["unit"].endswith("/s"):
+            change = old / new - 1
+        else:
+            change = new / old - 1
+        if change > tolerance:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chain, stats and scoring code.")
+    parser.add_argument("--graph", default=GRAPH_PATH)
+    parser.add_argument("--save", metavar="PATH", nargs="?", const=BASELINE_FILE,
+                        help="save the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", nargs="?", const=BASELINE_FILE,
+                        help="compare the results to a JSON baseline and exit 1 on a regression")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    import_results, plotting = bench_imports()
+    results = dict(import_results, **run_suite(args.graph))
+    for name, res in results.items():
+        print(f"{name}: {res['value']:.6g} {res['unit']}", flush=True)
+    for module, loaded in plotting.items():
+        print(f"NOT HEADLESS {module}: importing it loads {', '.join(loaded)}", flush=True)
+
+    if args.save:
+        with open(args.save, "w") as f_out:
+            json.dump(results, f_out, indent=2)
+        print(f"Saved baseline to {args.save}", flush=True)
+
+    if args.compare:
+        with open(args.compare) as f_in:
+            baseline = json.load(f_in)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, new, change in regressions:
+            print(f"REGRESSION {name}: {old:.6g} -> {new:.6g} ({change:+.0%} slower)", flush=True)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.compare}", flush=True)
+
+    if plotting:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
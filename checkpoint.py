@@ -0,0 +1,63 @@
+import os
+import pickle
+import random
+import numpy as np
+
+
+def rng_state():
+    """
+    Returns the state of Python's and NumPy's global random number generators,
+    which together drive every gerrychain proposal.
+    """
+    return {"random": random.getstate(), "numpy": np.random.get_state()}
+
+
+def restore_rng_state(state):
+    random.setstate(state["random"])
+    np.random.set_state(state["numpy"])
+
+
+def encode_assignment(partition, nodes):
+    """
+    Returns a partition's assignment as a compact array of district codes in the
+    order of nodes, along with the district labels the codes index into.
+    """
+    labels = sorted(partition.parts.keys())
+    label_index = {label: i for i, label in enumerate(labels)}
+    dtype = np.uint8 if len(labels) <= 256 else np.int32
+    codes = np.fromiter((label_index[partition.assignment[node]] for node in nodes),
+                        dtype=dtype, count=len(nodes))
+    return codes, labels
+
+
+def decode_assignment(codes, labels):
+    """
+    Returns the district label of every node from encode_assignment's output.
+    """
+    return np.asarray(labels, dtype=object)[codes].tolist()
+
+
+def save_checkpoint(path, state):
+    """
+    Pickles a checkpoint's state dict to path. It is written under a temporary
+    name and renamed into place, so a run killed mid-write keeps its previous
+    checkpoint.
+    """
+    out_dir = os.path.dirname(path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    with open(path + ".tmp", "wb") as f_out:
+        pickle.dump(state, f_out)
+    os.replace(path + ".tmp", path)
+
+
+def load_checkpoint(path, kind):
+    """
+    Loads a checkpoint written by save_checkpoint, checking it was written by
+    the kind of run that is resuming it.
+    """
+    with open(path, "rb") as f_in:
+        state = pickle.load(f_in)
+    if state.get("kind") != kind:
+        raise ValueError(f"{path} is a {state.get('kind')} checkpoint, not {kind}")
+    return state
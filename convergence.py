@@ -0,0 +1,164 @@
+import itertools
+import json
+import os
+import random
+import numpy as np
+import checkpoint
+import parallel_ensemble
+from ensemble_store import EnsembleStore
+
+CHECK_EVERY = 500  # Steps each chain takes between convergence checks
+RHAT_TARGET = 1.01  # A statistic has converged once its split-R-hat is at most this...
+ESS_TARGET = 400  # ...and its effective sample size across chains is at least this
+REPORT_FILE = "convergence.json"
+
+# Statistics tracked for convergence. The election ones are tracked per election.
+ELECTION_STATS = ["eg", "mm", "d_wins"]
+PLAN_STATS = ["cut_edges", "num_majority_black"]
+
+
+def split_chains(draws):
+    """
+    Splits each chain of a (chains x draws) array in half, dropping the
+    middle draw of odd-length chains, so trends within a chain show up as
+    disagreement between chains.
+    """
+    half = draws.shape[1] // 2
+    return np.concatenate([draws[:, :half], draws[:, draws.shape[1] - half:]])
+
+
+def rhat(draws):
+    """
+    Returns the split-R-hat of a (chains x draws) array: the ratio of the
+    pooled variance estimate to the mean within-chain variance of the split
+    chains. Statistics that never vary get 1.
+    """
+    draws = split_chains(np.asarray(draws, dtype=np.float64))
+    n = draws.shape[1]
+    within = draws.var(axis=1, ddof=1).mean()
+    between = n * draws.mean(axis=1).var(ddof=1)
+    if within == 0:
+        return 1.0 if between == 0 else np.inf
+    return float(np.sqrt(((n - 1) / n * within + between / n) / within))
+
+
+def ess(draws):
+    """
+    Returns the effective sample size of a (chains x draws) array, from the
+    autocorrelations of the split chains combined across chains and summed
+    over Geyer's initial monotone sequence (as in Stan). Statistics that
+    never vary get the number of draws.
+    """
+    draws = split_chains(np.asarray(draws, dtype=np.float64))
+    m, n = draws.shape
+    centered = draws - draws.mean(axis=1, keepdims=True)
+    spectrum = np.fft.rfft(centered, 2 * n, axis=1)
+    acov = np.fft.irfft(spectrum * np.conj(spectrum), axis=1)[:, :n] / n
+
+    within = acov[:, 0].mean() * n / (n - 1)
+    var_plus = within * (n - 1) / n + draws.mean(axis=1).var(ddof=1)
+    if var_plus == 0:
+        return float(m * n)
+    rho = 1 - (within - acov.mean(axis=0)) / var_plus
+
+    pairs = rho[:n - n % 2].reshape(-1, 2).sum(axis=1)
+    nonpositive = np.flatnonzero(pairs <= 0)
+    pairs = np.minimum.accumulate(pairs[:nonpositive[0] if len(nonpositive) else len(pairs)])
+    tau = max(-1 + 2 * pairs.sum(), 1 / np.log10(m * n))
+    return float(m * n / tau)
+
+
+def tracked_draws(stores, num_steps):
+    """
+    Returns each tracked statistic's (chains x steps) draws over the first
+    num_steps rows of each chain's store, by name (e.g. "eg_G18GOV").
+    """
+    draws = {}
+    for e, election in enumerate(stores[0].election_names):
+        for stat in ELECTION_STATS:
+            draws[f"{stat}_{election}"] = np.stack([store.columns[stat][:num_steps, e]
+                                                    for store in stores])
+    for stat in PLAN_STATS:
+        draws[stat] = np.stack([store.columns[stat][:num_steps] for store in stores])
+    return draws
+
+
+def diagnose(stores, num_steps):
+    """
+    Returns the split-R-hat and ESS of every tracked statistic.
+    """
+    return {name: {"rhat": rhat(draws), "ess": ess(draws)}
+            for name, draws in tracked_draws(stores, num_steps).items()}
+
+
+def run_converged_ensemble(initial_partition, elections, walk, stats_row, num_dists, num_chains=4,
+                           max_steps=10000, check_every=None, rhat_target=None, ess_target=None,
+                           seed=0, out_dir=None):
+    """
+    Runs num_chains ReCom chains from the initial partition in lockstep and
+    stops them all once every tracked statistic has a split-R-hat of at most
+    rhat_target and an ESS of at least ess_target, checked every check_every
+    steps, or after max_steps steps. Those three default to CHECK_EVERY,
+    RHAT_TARGET and ESS_TARGET as set when the run starts. Each chain is
+    walk(initial_partition, max_steps), e.g. gerrychainGA's
+    execute_random_walk with the graph bound, and each plan's stats are stats_row(partition, election_names) over
+    num_dists districts. Each chain keeps its own random state, seeded from
+    parallel_ensemble.chain_seeds(seed, num_chains), so it visits the same
+    plans however often it is checked. Returns the chains' stats merged into
+    one EnsembleStore (in out_dir if given) and a report of every check and
+    why the run ended, which is also saved to out_dir.
+    """
+    check_every = CHECK_EVERY if check_every is None else check_every
+    rhat_target = RHAT_TARGET if rhat_target is None else rhat_target
+    ess_target = ESS_TARGET if ess_target is None else ess_target
+    election_names = [election.name for election in elections]
+    seeds = parallel_ensemble.chain_seeds(seed, num_chains)
+    walks, stores, rng_states = [], [], []
+    for chain_seed in seeds:
+        random.seed(chain_seed)
+        np.random.seed(chain_seed)
+        chain = walk(initial_partition, max_steps)
+        # A MarkovChain restarts whenever it is iterated afresh, so each batch
+        # has to come from one generator over it
+        walks.append(partition for partition in chain)
+        stores.append(EnsembleStore(max_steps, election_names, num_dists))
+        rng_states.append(checkpoint.rng_state())
+
+    checks = []
+    num_steps = 0
+    reason = f"reached max_steps ({max_steps}) before every statistic converged"
+    while num_steps < max_steps:
+        batch = min(check_every, max_steps - num_steps)
+        for c in range(num_chains):
+            checkpoint.restore_rng_state(rng_states[c])
+            for partition in itertools.islice(walks[c], batch):
+                stores[c].append(**stats_row(partition, election_names))
+            stores[c].flush()
+            rng_states[c] = checkpoint.rng_state()
+        num_steps += batch
+
+        diagnostics = diagnose(stores, num_steps)
+        unconverged = [name for name, stats in diagnostics.items()
+                       if not (stats["rhat"] <= rhat_target and stats["ess"] >= ess_target)]
+        checks.append({"steps": num_steps, "diagnostics": diagnostics, "unconverged": unconverged})
+        print(f"{num_steps} steps: {len(diagnostics) - len(unconverged)}/{len(diagnostics)} "
+              f"statistics converged", flush=True)
+
+        if not unconverged:
+            reason = (f"every statistic reached R-hat <= {rhat_target} and "
+                      f"ESS >= {ess_target} after {num_steps} steps per chain")
+            break
+
+    merged = EnsembleStore(num_chains * num_steps, election_names, num_dists, out_dir=out_dir)
+    for chain_id, (chain_seed, store) in enumerate(zip(seeds, stores)):
+        merged.extend(store, chain_id=chain_id, seed=chain_seed)
+
+    report = {"reason": reason, "converged": not checks[-1]["unconverged"],
+              "steps_per_chain": num_steps, "num_chains": num_chains,
+              "rhat_target": rhat_target, "ess_target": ess_target,
+              "unconverged": checks[-1]["unconverged"], "checks": checks}
+    print(f"Stopped: {reason}", flush=True)
+    if out_dir is not None:
+        with open(os.path.join(out_dir, REPORT_FILE), "w") as f_out:
+            json.dump(report, f_out, indent=2)
+    return merged, report
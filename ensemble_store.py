@@ -0,0 +1,223 @@
+import json
+import os
+import numpy as np
+
+# Column name -> (dtype, per-row shape kind). "election" columns hold one value
+# per election, "vote_share" columns hold one sorted vote share per district
+# per election, and "plan" columns hold a single value per plan.
+STAT_COLUMNS = {"eg": (np.float64, "election"),
+                "mm": (np.float64, "election"),
+                "d_wins": (np.int16, "election"),
+                "r_wins": (np.int16, "election"),
+                "dem_vote_share_pd": (np.float32, "vote_share"),
+                "cut_edges": (np.int32, "plan"),
+                "num_majority_black": (np.int16, "plan")}
+
+META_FILE = "meta.json"
+SUMMARY_FILE = "summary.p"  # Written by ensemble_summary.EnsembleSummary in place of the columns
+
+
+class EnsembleStore:
+    """
+    EnsembleStore class
+
+    Preallocated columnar storage for the plan stats of an ensemble. Every column
+    is a typed NumPy array with one row per step, so no per-step Python lists
+    are built. With an out_dir the columns are memory-mapped .npy files and rows
+    are written in chunks of chunk_size, which keeps memory bounded for very
+    long chains.
+    """
+
+    def __init__(self, num_steps, election_names, num_dists, out_dir=None,
+                 chunk_size=1024):
+        self.num_steps = num_steps
+        self.election_names = list(election_names)
+        self.num_dists = num_dists
+        self.out_dir = out_dir
+        self.chunk_size = min(chunk_size, max(num_steps, 1))
+        self.num_written = 0
+        self._num_buffered = 0
+        # Provenance of the rows copied in from other stores by extend
+        self.chains = []
+
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+            # A summary left in out_dir by an earlier run would be opened instead of this store
+            summary_path = os.path.join(out_dir, SUMMARY_FILE)
+            if os.path.exists(summary_path):
+                os.remove(summary_path)
+
+        self.columns = {key: self._allocate(key, num_steps) for key in STAT_COLUMNS}
+        self._allocate_buffers()
+
+
+    def _allocate_buffers(self):
+        self._buffers = {key: np.empty(self._row_shape(key, self.chunk_size), dtype=dtype)
+                         for key, (dtype, _) in STAT_COLUMNS.items()}
+
+
+    def _row_shape(self, key, num_rows):
+        kind = STAT_COLUMNS[key][1]
+        if kind == "election":
+            return (num_rows, len(self.election_names))
+        elif kind == "vote_share":
+            return (num_rows, len(self.election_names), self.num_dists)
+        return (num_rows,)
+
+
+    def _allocate(self, key, num_rows):
+        dtype = STAT_COLUMNS[key][0]
+        if self.out_dir is None:
+            return np.zeros(self._row_shape(key, num_rows), dtype=dtype)
+        return np.lib.format.open_memmap(os.path.join(self.out_dir, f"{key}.npy"), mode="w+",
+                                         dtype=dtype, shape=self._row_shape(key, num_rows))
+
+
+    def __len__(self):
+        return self.num_written + self._num_buffered
+
+
+    def append(self, eg, mm, d_wins, r_wins, dem_vote_share_pd, cut_edges,
+               num_majority_black):
+        """
+        Records the stats of one plan. The election columns take one value per
+        election (in the order of election_names) and dem_vote_share_pd takes
+        one sorted vote share vector per election.
+        """
+        if len(self) >= self.num_steps:
+            raise IndexError(f"EnsembleStore is full ({self.num_steps} steps)")
+
+        row = self._num_buffered
+        self._buffers["eg"][row] = eg
+        self._buffers["mm"][row] = mm
+        self._buffers["d_wins"][row] = d_wins
+        self._buffers["r_wins"][row] = r_wins
+        self._buffers["dem_vote_share_pd"][row] = dem_vote_share_pd
+        self._buffers["cut_edges"][row] = cut_edges
+        self._buffers["num_majority_black"][row] = num_majority_black
+        self._num_buffered += 1
+
+        if self._num_buffered == self.chunk_size:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Copies the buffered rows into the backing columns and, for a store on
+        disk, writes them out along with the metadata.
+        """
+        if self._num_buffered == 0:
+            return
+
+        start, stop = self.num_written, self.num_written + self._num_buffered
+        for key, column in self.columns.items():
+            column[start:stop] = self._buffers[key][:self._num_buffered]
+        self.num_written = stop
+        self._num_buffered = 0
+
+        if self.out_dir is not None:
+            for column in self.columns.values():
+                column.flush()
+            self._write_meta()
+
+
+    def _write_meta(self):
+        meta = {"num_steps": self.num_steps,
+                "num_written": self.num_written,
+                "election_names": self.election_names,
+                "num_dists": self.num_dists,
+                "chains": self.chains}
+        with open(os.path.join(self.out_dir, META_FILE), "w") as f_out:
+            json.dump(meta, f_out)
+
+
+    def extend(self, other, chain_id=None, seed=None):
+        """
+        Copies every row of another store (e.g. one independent chain) onto the
+        end of this one, recording which chain and seed the rows came from.
+        """
+        self.flush()
+        other.flush()
+        start, stop = self.num_written, self.num_written + len(other)
+        if stop > self.num_steps:
+            raise IndexError(f"EnsembleStore is full ({self.num_steps} steps)")
+
+        for key, column in self.columns.items():
+            column[start:stop] = other.columns[key][:len(other)]
+        self.num_written = stop
+        self.chains.append({"chain_id": chain_id, "seed": seed,
+                            "start": start, "stop": stop})
+
+        if self.out_dir is not None:
+            for column in self.columns.values():
+                column.flush()
+            self._write_meta()
+
+
+    def truncate(self, num_rows):
+        """
+        Discards every row after the first num_rows, e.g. rows a run recorded
+        after the checkpoint it is being resumed from.
+        """
+        self.flush()
+        self.num_written = min(self.num_written, num_rows)
+        self.chains = [dict(chain, stop=min(chain["stop"], num_rows))
+                       for chain in self.chains if chain["start"] < num_rows]
+        if self.out_dir is not None:
+            self._write_meta()
+
+
+    def _prefix_rows(self, stop):
+        if not self.chains:
+            return slice(0, min(stop, self.num_written))
+        return np.concatenate([np.arange(chain["start"], min(chain["start"] + stop, chain["stop"]))
+                               for chain in self.chains])
+
+
+    def election_data(self, election, stop=None):
+        """
+        Returns the stats of one election as a dict with the keys of
+        DATA_DICT_FORMAT. The values are arrays over the first `stop` recorded
+        steps (all of them by default), so the plotting functions can use them
+        directly. For a store merged from several chains, `stop` applies to
+        each chain.
+        """
+        self.flush()
+        rows = self._prefix_rows(self.num_written if stop is None else stop)
+        e = self.election_names.index(election)
+
+        return {"eg": self.columns["eg"][rows, e],
+                "mm": self.columns["mm"][rows, e],
+                "d_wins": self.columns["d_wins"][rows, e],
+                "r_wins": self.columns["r_wins"][rows, e],
+                "cut_edges": self.columns["cut_edges"][rows],
+                "dem_vote_share_pd": self.columns["dem_vote_share_pd"][rows, e],
+                "num_majority_black": self.columns["num_majority_black"][rows]}
+
+
+    @classmethod
+    def load(cls, out_dir, mode="r", chunk_size=1024):
+        """
+        Opens a store previously written to out_dir with its columns
+        memory-mapped, without reading them into memory. Opened with
+        mode="r+", rows can be appended after the ones already written.
+        """
+        with open(os.path.join(out_dir, META_FILE)) as f_in:
+            meta = json.load(f_in)
+
+        store = cls.__new__(cls)
+        store.num_steps = meta["num_steps"]
+        store.election_names = meta["election_names"]
+        store.num_dists = meta["num_dists"]
+        store.out_dir = out_dir
+        store.num_written = meta["num_written"]
+        store.chains = meta.get("chains", [])
+        store.chunk_size = 0
+        store._num_buffered = 0
+        store._buffers = {}
+        store.columns = {key: np.load(os.path.join(out_dir, f"{key}.npy"), mmap_mode=mode)
+                         for key in STAT_COLUMNS}
+        if mode != "r":
+            store.chunk_size = min(chunk_size, max(store.num_steps, 1))
+            store._allocate_buffers()
+        return store
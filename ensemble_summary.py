@@ -0,0 +1,272 @@
+import copy
+import os
+import numpy as np
+import checkpoint
+from ensemble_store import META_FILE, STAT_COLUMNS, SUMMARY_FILE
+
+# Bins of the streaming histograms. Efficiency gaps and mean-median scores lie
+# in [-1, 1] and vote shares in [0, 1], so both grids resolve values to 0.0005,
+# far finer than the 20 bins the figures are drawn with.
+METRIC_RANGE = (-1.0, 1.0)
+METRIC_BINS = 4000
+VOTE_SHARE_BINS = 2000
+
+
+class StreamingHistogram:
+    """
+    StreamingHistogram class
+
+    Fixed-bin histograms of one or more series of real values (e.g. one per
+    election), along with each series' exact minimum and maximum. Memory does
+    not depend on how many values are added. Values outside [lo, hi] are
+    counted in the end bins.
+    """
+
+    def __init__(self, shape, lo, hi, num_bins):
+        self.shape = tuple(shape)
+        self.lo = lo
+        self.hi = hi
+        self.num_bins = num_bins
+        num_series = int(np.prod(self.shape))
+        self.counts = np.zeros((num_series, num_bins), dtype=np.int64)
+        self.min = np.full(num_series, np.inf)
+        self.max = np.full(num_series, -np.inf)
+        self._series = np.arange(num_series)
+        self._scale = num_bins / (hi - lo)
+
+
+    def add(self, values):
+        """
+        Adds one value to every series; values has the histogram's shape.
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        bins = np.clip(((values - self.lo) * self._scale).astype(np.intp), 0, self.num_bins - 1)
+        self.counts[self._series, bins] += 1
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+
+
+    def merge(self, other):
+        self.counts += other.counts
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+
+
+    def _centers(self, i):
+        centers = self.lo + (np.arange(self.num_bins) + 0.5) / self._scale
+        return np.clip(centers, self.min[i], self.max[i])
+
+
+    def samples(self, i):
+        """
+        Returns the values and counts of series i's non-empty bins, which can
+        be drawn with ax.hist(values, weights=counts).
+        """
+        nonzero = np.flatnonzero(self.counts[i])
+        return self._centers(i)[nonzero], self.counts[i, nonzero]
+
+
+    def quantiles(self, i, qs):
+        """
+        Returns the quantiles qs of series i, to within a bin.
+        """
+        cdf = np.cumsum(self.counts[i])
+        bins = np.searchsorted(cdf, np.asarray(qs) * cdf[-1], side="left")
+        return self._centers(i)[np.minimum(bins, self.num_bins - 1)]
+
+
+    def box_stats(self, i, whis=1.5):
+        """
+        Returns the stats ax.bxp draws a box from for series i, as
+        matplotlib's boxplot_stats would from the raw values. Each non-empty
+        bin beyond the whiskers is drawn as one flier.
+        """
+        q1, med, q3 = self.quantiles(i, [0.25, 0.5, 0.75])
+        iqr = q3 - q1
+        values, _ = self.samples(i)
+        inside = values[(values >= q1 - whis * iqr) & (values <= q3 + whis * iqr)]
+        whislo = inside.min() if len(inside) else q1
+        whishi = inside.max() if len(inside) else q3
+        # The end bins' values are the exact minimum and maximum
+        if self.min[i] >= q1 - whis * iqr:
+            whislo = self.min[i]
+        if self.max[i] <= q3 + whis * iqr:
+            whishi = self.max[i]
+        return {"med": med, "q1": q1, "q3": q3, "iqr": iqr, "whislo": whislo, "whishi": whishi,
+                "fliers": values[(values < whislo) | (values > whishi)]}
+
+
+class CountTable:
+    """
+    CountTable class
+
+    Counts of the non-negative integer values (e.g. districts won) taken by
+    one or more series. The table only grows with the largest value seen,
+    not with how many values are added.
+    """
+
+    def __init__(self, shape, size=16):
+        self.shape = tuple(shape)
+        num_series = int(np.prod(self.shape))
+        self.counts = np.zeros((num_series, size), dtype=np.int64)
+        self._series = np.arange(num_series)
+
+
+    def _grow(self, size):
+        width = self.counts.shape[1]
+        if size > width:
+            self.counts = np.pad(self.counts, ((0, 0), (0, max(size, 2 * width) - width)))
+
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.intp).reshape(-1)
+        self._grow(values.max() + 1)
+        self.counts[self._series, values] += 1
+
+
+    def merge(self, other):
+        self._grow(other.counts.shape[1])
+        self.counts[:, :other.counts.shape[1]] += other.counts
+
+
+    def samples(self, i):
+        """
+        Returns the values taken by series i and how often each was taken.
+        """
+        values = np.flatnonzero(self.counts[i])
+        return values, self.counts[i, values]
+
+
+class EnsembleSummary:
+    """
+    EnsembleSummary class
+
+    A fixed-memory alternative to EnsembleStore for very long chains. Rather
+    than one row per step it keeps streaming histograms of the efficiency gaps
+    and mean-median scores, count tables of the wins, cut edges and majority
+    black districts, and a histogram per election and sorted district rank of
+    the Democratic vote shares, from which the box plots are drawn. The
+    sketches are copied as the chain passes each of horizons, so shorter
+    horizons can be plotted from one chain. It takes the same rows as
+    EnsembleStore.append and, with an out_dir, is saved there on flush.
+    """
+
+    def __init__(self, num_steps, election_names, num_dists, horizons=(), out_dir=None):
+        self.num_steps = num_steps
+        self.election_names = list(election_names)
+        self.num_dists = num_dists
+        self.horizons = sorted(h for h in horizons if h < num_steps)
+        self.out_dir = out_dir
+        self.num_written = 0
+        self.chains = []
+        # Stats of the first recorded plan, i.e. the initial plan
+        self.initial = None
+
+        num_elections = len(self.election_names)
+        self.sketches = {"eg": StreamingHistogram((num_elections,), *METRIC_RANGE, METRIC_BINS),
+                         "mm": StreamingHistogram((num_elections,), *METRIC_RANGE, METRIC_BINS),
+                         "d_wins": CountTable((num_elections,)),
+                         "r_wins": CountTable((num_elections,)),
+                         "dem_vote_share_pd": StreamingHistogram((num_elections, num_dists), 0.0, 1.0,
+                                                                 VOTE_SHARE_BINS),
+                         "cut_edges": CountTable((1,), size=1024),
+                         "num_majority_black": CountTable((1,))}
+        self.snapshots = {}
+
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+            # Drop the columns of an EnsembleStore written to out_dir by an earlier run
+            for name in [META_FILE] + [f"{key}.npy" for key in STAT_COLUMNS]:
+                path = os.path.join(out_dir, name)
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+    def __len__(self):
+        return self.num_written
+
+
+    def append(self, **row):
+        """
+        Adds the stats of one plan, given as the keyword arguments of
+        EnsembleStore.append.
+        """
+        if len(self) >= self.num_steps:
+            raise IndexError(f"EnsembleSummary is full ({self.num_steps} steps)")
+
+        if self.initial is None:
+            self.initial = {key: np.array(value) for key, value in row.items()}
+        for key, sketch in self.sketches.items():
+            sketch.add(row[key])
+        self.num_written += 1
+
+        if self.num_written in self.horizons:
+            self.snapshots[self.num_written] = copy.deepcopy(self.sketches)
+
+
+    def flush(self):
+        """
+        Saves the summary to out_dir, if it has one.
+        """
+        if self.out_dir is not None:
+            checkpoint.save_checkpoint(os.path.join(self.out_dir, SUMMARY_FILE),
+                                       {"kind": "ensemble_summary", "summary": self})
+
+
+    def truncate(self, num_rows):
+        """
+        Summaries can't drop rows, so this only checks that the summary holds
+        exactly num_rows, as the copy saved in a checkpoint does. The copy in
+        out_dir may be ahead of the last checkpoint.
+        """
+        if num_rows != len(self):
+            raise ValueError(f"EnsembleSummary holds {len(self)} steps, not {num_rows}")
+
+
+    def extend(self, other, chain_id=None, seed=None):
+        """
+        Merges another summary (e.g. one independent chain) into this one,
+        recording which chain and seed its steps came from.
+        """
+        start, stop = self.num_written, self.num_written + len(other)
+        if stop > self.num_steps:
+            raise IndexError(f"EnsembleSummary is full ({self.num_steps} steps)")
+
+        # A chain shorter than a horizon counts in full towards it
+        for horizon in set(self.snapshots) | set(other.snapshots):
+            snapshot = self.snapshots.setdefault(horizon, copy.deepcopy(self.sketches))
+            for key, sketch in snapshot.items():
+                sketch.merge(other.snapshots.get(horizon, other.sketches)[key])
+        for key, sketch in self.sketches.items():
+            sketch.merge(other.sketches[key])
+        if self.initial is None:
+            self.initial = other.initial
+
+        self.num_written = stop
+        self.chains.append({"chain_id": chain_id, "seed": seed, "start": start, "stop": stop})
+        self.flush()
+
+
+    def sketches_at(self, stop=None):
+        """
+        Returns the sketches over the first `stop` steps of each chain (all of
+        them by default). stop must be one of the summary's horizons or cover
+        the whole chain.
+        """
+        if stop in self.snapshots:
+            return self.snapshots[stop]
+        chain_steps = max((chain["stop"] - chain["start"] for chain in self.chains), default=len(self))
+        if stop is None or stop >= chain_steps:
+            return self.sketches
+        raise ValueError(f"No summary at {stop} steps; horizons are {sorted(self.snapshots)}")
+
+
+    @classmethod
+    def load(cls, out_dir):
+        """
+        Opens a summary previously saved to out_dir.
+        """
+        summary = checkpoint.load_checkpoint(os.path.join(out_dir, SUMMARY_FILE),
+                                             "ensemble_summary")["summary"]
+        summary.out_dir = out_dir
+        return summary
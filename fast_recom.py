@@ -0,0 +1,168 @@
+import random
+import warnings
+import weakref
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree, depth_first_order
+from gerrychain.graph import FrozenGraph
+from gerrychain.tree import BipartitionWarning
+from graph_cache import NodePositions
+
+# Kernels built so far, by graph and then pop_col. An entry goes away with its
+# graph, so a process that loads many graphs doesn't keep their kernels alive.
+_kernels = weakref.WeakKeyDictionary()
+
+
+class RecomKernel:
+    """
+    RecomKernel class
+
+    The array form of a graph used by fast_recom: the adjacency in CSR form over
+    node positions, the population column as a NumPy array, and scratch buffers
+    reused by every proposal. Bipartitioning two merged districts then works on
+    arrays only: a random spanning tree is the minimum spanning tree under
+    uniform random edge weights (the same Kruskal-with-random-weights tree
+    gerrychain draws), and a single pass over the tree in reverse depth-first
+    order gives every subtree's population.
+    """
+
+    def __init__(self, graph, pop_col):
+        self.node_positions = NodePositions(graph)
+        self.nodes = self.node_positions.nodes
+
+        neighbors = [[self.node_positions.index[nbr] for nbr in graph.adj[node]] for node in self.nodes]
+        self.indptr = np.cumsum([0] + [len(nbrs) for nbrs in neighbors]).astype(np.intp)
+        self.indices = np.fromiter((i for nbrs in neighbors for i in nbrs), dtype=np.intp,
+                                   count=self.indptr[-1])
+        self.pop = np.array([graph.nodes[node][pop_col] for node in self.nodes], dtype=np.float64)
+
+        # Position of each node within the region being split, -1 outside it
+        self._local = np.full(len(self.nodes), -1, dtype=np.intp)
+
+
+    def region_edges(self, idx):
+        """
+        Returns the edges of the subgraph induced by the nodes at positions idx,
+        as two arrays of positions within idx with u < v.
+        """
+        starts = self.indptr[idx]
+        counts = self.indptr[idx + 1] - starts
+        offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        src = np.repeat(np.arange(len(idx)), counts)
+        dst = self._local[self.indices[np.arange(counts.sum()) + offsets]]
+        keep = dst > src
+        return src[keep], dst[keep]
+
+
+    def bipartition(self, idx, pop_target, epsilon, node_repeats=1, max_attempts=100000,
+                    warn_attempts=1000):
+        """
+        Splits the connected region at positions idx into two parts whose
+        populations are both within epsilon of pop_target, like gerrychain's
+        bipartition_tree: draw a random spanning tree, root it at a random
+        non-leaf node, and cut a random edge whose two sides are balanced,
+        trying node_repeats roots per tree. Returns a boolean mask over idx of
+        the cut-off subtree. As in gerrychain, warns after warn_attempts roots
+        and raises RuntimeError after max_attempts. Every random draw is
+        seeded from the random module, so seeding it fixes the chain.
+        """
+        rng = np.random.default_rng(random.getrandbits(64))
+        num_nodes = len(idx)
+        self._local[idx] = np.arange(num_nodes)
+        try:
+            u, v = self.region_edges(idx)
+        finally:
+            self._local[idx] = -1
+
+        pops = self.pop[idx]
+        total_pop = pops.sum()
+        tolerance = epsilon * pop_target
+        restarts = node_repeats
+
+        for attempts in range(1, max_attempts + 1):
+            if restarts == node_repeats:
+                # Shifting the weights away from 0, which scipy treats as a
+                # missing edge, doesn't change which tree is minimal
+                weights = 1.0 + rng.random(len(u))
+                tree = minimum_spanning_tree(csr_matrix((weights, (u, v)), shape=(num_nodes, num_nodes)))
+                tree_u, tree_v = tree.nonzero()
+                degree = np.bincount(tree_u, minlength=num_nodes) + np.bincount(tree_v, minlength=num_nodes)
+                roots = np.flatnonzero(degree > 1)
+                restarts = 0
+
+            root = roots[rng.integers(len(roots))]
+            order, pred = depth_first_order(tree, root, directed=False, return_predecessors=True)
+
+            # Children come after their parent in depth-first order, so walking
+            # it backwards accumulates every subtree's population and size
+            subtree_pop = pops.tolist()
+            subtree_size = [1] * num_nodes
+            parents = pred.tolist()
+            for node in order[:0:-1].tolist():
+                parent = parents[node]
+                subtree_pop[parent] += subtree_pop[node]
+                subtree_size[parent] += subtree_size[node]
+
+            subtree_pop = np.array(subtree_pop)
+            balanced = ((np.abs(subtree_pop - pop_target) <= tolerance)
+                        & (np.abs(total_pop - subtree_pop - pop_target) <= tolerance))
+            balanced[root] = False
+            # Nodes the tree doesn't reach from the root (only when the region
+            # isn't connected) have no subtree to cut off
+            reached = np.zeros(num_nodes, dtype=bool)
+            reached[order] = True
+            cuts = np.flatnonzero(balanced & reached)
+
+            if len(cuts) > 0:
+                cut = cuts[rng.integers(len(cuts))]
+                start = np.flatnonzero(order == cut)[0]
+                subtree = np.zeros(num_nodes, dtype=bool)
+                subtree[order[start:start + subtree_size[cut]]] = True
+                return subtree
+
+            restarts += 1
+            if attempts == warn_attempts:
+                warnings.warn(f"\nFailed to find a balanced cut after {warn_attempts} attempts.\n"
+                              "Continuing to try...", BipartitionWarning)
+
+        raise RuntimeError(f"Could not find a possible cut after {max_attempts} attempts.")
+
+
+def get_kernel(graph, pop_col):
+    """
+    Returns the RecomKernel of graph and pop_col, building it on first use.
+    Partitions hold their graph frozen, and the kernel is kept for the
+    underlying graph.
+    """
+    if isinstance(graph, FrozenGraph):
+        graph = graph.graph
+    kernels = _kernels.setdefault(graph, {})
+    if pop_col not in kernels:
+        kernels[pop_col] = RecomKernel(graph, pop_col)
+    return kernels[pop_col]
+
+
+def fast_recom(partition, pop_col, pop_target, epsilon, node_repeats=1):
+    """
+    Drop-in replacement for gerrychain's recom proposal: merges the two
+    districts on either side of a random cut edge and splits them again along
+    a balanced cut of a random spanning tree, all on arrays. The district
+    labelled first in sorted order gets the part holding the tree's root.
+    The cut edges and merged nodes are taken in sorted order rather than set
+    order, so the proposal depends only on the plan and the random state: a
+    plan rebuilt from its assignment (as a resumed chain's is) proposes the
+    same next plan as the original.
+    """
+    kernel = get_kernel(partition.graph, pop_col)
+
+    edge = random.choice(sorted(partition["cut_edges"]))
+    parts_to_merge = sorted([partition.assignment[edge[0]], partition.assignment[edge[1]]])
+
+    idx = np.sort(kernel.node_positions.positions(partition.parts[parts_to_merge[0]]
+                                   | partition.parts[parts_to_merge[1]]))
+    merged = kernel.node_positions.nodes_at(idx)
+    subtree = kernel.bipartition(idx, pop_target, epsilon, node_repeats)
+
+    flips = {node: parts_to_merge[1] if cut_off else parts_to_merge[0]
+             for node, cut_off in zip(merged, subtree.tolist())}
+    return partition.flip(flips)
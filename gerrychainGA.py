@@ -1,51 +1,84 @@
 # ------------------------- Import Libraries -------------------------
-import matplotlib.pyplot as plt
-import seaborn as sns
-from gerrychain import Graph, Partition, updaters, constraints, MarkovChain, Election
+from gerrychain import Partition, updaters, constraints, MarkovChain, Election
 from gerrychain.updaters import cut_edges, Tally
-from gerrychain.proposals import recom
+from fast_recom import fast_recom
 from gerrychain.accept import always_accept
 from functools import partial
+import os
 import time
 import numpy as np
-import pandas as pd
-from gerrychain.metrics import mean_median, efficiency_gap
+from ensemble_store import EnsembleStore
+from ensemble_summary import EnsembleSummary
+import parallel_ensemble
+import convergence
+import graph_cache
+import checkpoint
+from tally_engine import DistrictTallyEngine
+from telemetry import ChainTelemetry
 
 # ------------------------- Define Constants -------------------------
 POPULATION_TOLERANCE = 0.2
+POP_COL = "TOTPOP"  # Population the chain balances: the ReCom cuts, their ideal and the population constraint
 NUM_GA_DISTS = 14
 NUM_STEPS = [10, 1000, 2000, 5000]
+NUM_CHAINS = 1  # Independent chains per ensemble, run on a process pool when more than 1
+SEED = 0  # Base seed the parallel chains derive their seeds from
+NESTED_HORIZONS = True  # Run one chain of max(NUM_STEPS) steps and plot each horizon from its prefix
+SUMMARY_ONLY = False  # Keep fixed-memory sketches of the stats instead of every step's row
+CONVERGENCE_STOPPING = False  # Run CONVERGENCE_CHAINS chains until every stat converges (see convergence.py), for at most max(NUM_STEPS) steps
+CONVERGENCE_CHAINS = 4
+
+GRAPH_PATH = "./GA_clean.json"
+ENSEMBLE_DIR = "./output/ensemble"
+FIGURE_DIR = "./output"  # Where report.py renders the figures
+CHECKPOINT_FILE = "checkpoint.p"  # Written to each ensemble's directory while its chain runs
+CHECKPOINT_EVERY = 1000  # Steps between checkpoints
+TELEMETRY_FILE = None  # e.g. "telemetry.json" (or .csv) to profile each single-chain ensemble into its directory
 
 DATA_DICT_FORMAT = {"eg": [], "mm": [], "d_wins": [], "r_wins": [], "cut_edges": [], "dem_vote_share_pd": [], "num_majority_black": []}
 
 # ---------------------------- Load Graph ----------------------------
 def load_graph(file_path):
-    return Graph.from_json(file_path)
+    return graph_cache.load_graph(file_path)
 
 # ------------------ Calculate The Total Population ------------------
-def find_tot_pop(graph):
-    return sum([graph.nodes()[v]['TOTPOP'] for v in graph.nodes()])
+def find_tot_pop(graph, pop_col="TOTPOP"):
+    return sum([graph.nodes()[v][pop_col] for v in graph.nodes()])
 
 def majority_bvap_districts(partition):
     """
     Returns the number of districts in the partition that have a majority
     Black voting-age population (BVAP > 50%).
     """
-    num_majority_black = 0
-    for district_id, district_dict in partition["BVAP"].items():
-        vap = partition["VAP"][district_id]
-        bvap = district_dict
-        if bvap / vap > 0.5:
-            num_majority_black += 1
-    return num_majority_black
+    tallies = partition["district_tallies"]
+    return int(np.count_nonzero(tallies.ratio("BVAP", "VAP") > 0.5))
+
+def build_elections():
+    """
+    Elections from GA_clean.json:
+        "G18GOVRKEM": 193,
+        "G18GOVDABR": 309,
+        "G18ATGRCAR": 206,
+        "G18ATGDBAI": 301,
+        "G18AGRRBLA": 210,
+        "G18AGRDSWA": 295,
+    """
+    return [
+        Election("G18GOV", {"Democratic": "G18GOVDABR", "Republican": "G18GOVRKEM"}),
+        Election("G18ATG", {"Democratic": "G18ATGDBAI", "Republican": "G18ATGRCAR"}),
+        Election("G18AGR", {"Democratic": "G18AGRDSWA", "Republican": "G18AGRRBLA"}),
+    ]
 
 # ------------------- Set Up The Initial Partition -------------------
 def initialize_partition(elections, graph):
-    my_updaters = {"population": updaters.Tally("TOTPOP", alias="population"), 
+    my_updaters = {"population": updaters.Tally(POP_COL, alias="population"), 
             "cut_edges": cut_edges, 
             "VAP": Tally("VAP", alias="VAP"),
             "BVAP": Tally("BVAP", alias="BVAP"),
-            "majority_bvap_districts": majority_bvap_districts
+            "majority_bvap_districts": majority_bvap_districts,
+            "district_tallies": DistrictTallyEngine(graph, ["TOTPOP", "VAP", "BVAP"],
+                                                    sorted({graph.nodes[node]["CD"] for node in graph.nodes}),
+                                                    elections)
         }
     election_updaters = {election.name: election for election in elections}
     my_updaters.update(election_updaters)
@@ -58,12 +91,16 @@ def initialize_partition(elections, graph):
     return initial_partition
 
 # ----------------------- Execute Random Walk ------------------------
-def execute_random_walk(initial_partition, num_steps, num_dist, graph):
-    tot_pop = find_tot_pop(graph)
+def execute_random_walk(initial_partition, num_steps, num_dist, graph, pop_col=None):
+    # The cuts are balanced against the ideal of the column they split. By
+    # default that is POP_COL, which the population constraint also tallies.
+    if pop_col is None:
+        pop_col = POP_COL
+    tot_pop = find_tot_pop(graph, pop_col)
     ideal_pop = tot_pop / num_dist
 
-    random_walk_partial = partial(recom,
-                                  pop_col="VAP",
+    random_walk_partial = partial(fast_recom,
+                                  pop_col=pop_col,
                                   epsilon=POPULATION_TOLERANCE,
                                   pop_target=ideal_pop,
                                   node_repeats=2,
@@ -84,207 +121,267 @@ def get_plan_stats(dict_to_update, partition, election_name):
     # return_dict = {"eg": [], "mm": [], "d_wins": [], "r_wins": [], "cut_edges": [], "dem_vote_share_pd": [], "num_majority_black": []}
     
     # Calculate statistics on the initial partition
-    dict_to_update["eg"].append(efficiency_gap(partition[election_name]))
-    dict_to_update["mm"].append(mean_median(partition[election_name]))
-    dict_to_update["d_wins"].append(partition[election_name].wins("Democratic"))
-    dict_to_update["r_wins"].append(partition[election_name].wins("Republican"))
+    tallies = partition["district_tallies"]
+    e = tallies.engine.election_names.index(election_name)
+
+    dict_to_update["eg"].append(tallies.efficiency_gaps()[e])
+    dict_to_update["mm"].append(tallies.mean_medians()[e])
+    dict_to_update["d_wins"].append(tallies.wins("Democratic")[e])
+    dict_to_update["r_wins"].append(tallies.wins("Republican")[e])
     dict_to_update["cut_edges"].append(len(partition["cut_edges"]))
-    dict_to_update["dem_vote_share_pd"].append(sorted(partition[election_name].percents("Democratic")))
+    dict_to_update["dem_vote_share_pd"].append(sorted(tallies.percents("Democratic")[e]))
     dict_to_update["num_majority_black"].append(partition["majority_bvap_districts"])
 
     return dict_to_update
 
 
+def new_data_dict():
+    """
+    Returns an empty stats dict with the keys of DATA_DICT_FORMAT. Each key gets
+    its own list, so dicts handed to different elections never share storage.
+    """
+    return {key: [] for key in DATA_DICT_FORMAT}
 
-def generate_output_fname(election, num_steps, metric):
-    return f"./output/{num_steps}steps/{election}_{metric}.png"
-
-# ------------------- Graphing Fns ------------------------
-def graph_marginal_box_plots(vote_shares, election, steps):
-        
-    data = pd.DataFrame(vote_shares)
-
-    fig, ax = plt.subplots(figsize=(8, 6))
-
-    # Draw 50% line
-    ax.axhline(0.5, color="#cccccc")
-
-    # Draw boxplot
-    data.boxplot(ax=ax, positions=range(len(data.columns)))
-
-    # Draw initial plan's Democratic vote %s (.iloc[0] gives the first row, which corresponds to the initial plan)
-    plt.plot(data.iloc[0], "ro")
-
-    # Annotate
-    ax.set_title(f"{election} election vote shares ({steps} Steps)")
-    ax.set_ylabel("Democratic vote %")
-    ax.set_xlabel("Sorted districts")
-    ax.set_ylim(0, 1)
-    ax.set_yticks([0, 0.25, 0.5, 0.75, 1])
-
-    #plt.show()
-    plt.savefig(generate_output_fname(election, steps, "district_vs_boxplot"))
-    plt.close()
-
-def graph_eg(election, data_dict, initial_eg, steps):
-    plt.figure(figsize=(10, 8))
-    plt.hist(data_dict['eg'], bins=20, color='skyblue', edgecolor='black', alpha=0.7, align='left')
-    plt.title(f"Efficiency Gap Histogram - {election}")
-    plt.xlabel("Efficiency Gap")
-    plt.ylabel("Frequency")
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-
-    plt.axvline(x=initial_eg[0], color='r', linestyle='--', label='Initial Plan')
-    plt.legend()
-
-    plt.savefig(generate_output_fname(election, steps, "eg_histogram"))
-    plt.close()
+def get_plan_stats_row(partition, election_names):
+    """
+    Returns the stats of one plan for every election, laid out the way
+    EnsembleStore.append takes them. Every election is scored at once from the
+    plan's district tallies.
+    """
+    tallies = partition["district_tallies"]
+    e = [tallies.engine.election_names.index(name) for name in election_names]
+    metrics = tallies.election_metrics()
+
+    # Every election lists the Democratic column first
+    return {"eg": metrics["eg"][e],
+            "mm": metrics["mm"][e],
+            "d_wins": metrics["first_wins"][e],
+            "r_wins": metrics["second_wins"][e],
+            "dem_vote_share_pd": metrics["first_shares"][e],
+            "cut_edges": len(partition["cut_edges"]),
+            "num_majority_black": partition["majority_bvap_districts"]}
+
+def collect_ensemble_stats(random_walk, elections, out_dir=None, checkpoint_file=None,
+                           checkpoint_every=CHECKPOINT_EVERY, summary=False, horizons=(),
+                           telemetry=None):
+    """
+    Walks the chain once and records the plan stats of every election at each
+    step, so all elections are scored on the same ensemble of plans.
+    Returns an EnsembleStore preallocated for the chain's length, kept in
+    memory-mapped .npy files under out_dir if one is given. With summary, the
+    stats go into a fixed-memory EnsembleSummary instead, which also keeps
+    the stats of the given shorter horizons. With a checkpoint_file the walk
+    is checkpointed every checkpoint_every steps and can be continued by
+    resume_ensemble_stats. A telemetry.ChainTelemetry instruments the chain
+    while it runs and times the stats of every step.
+    """
+    election_names = [election.name for election in elections]
+    if summary:
+        store = EnsembleSummary(len(random_walk), election_names, NUM_GA_DISTS, horizons, out_dir)
+    else:
+        store = EnsembleStore(len(random_walk), election_names, NUM_GA_DISTS, out_dir=out_dir)
+    return walk_into_store(random_walk, store, checkpoint_file, checkpoint_every, telemetry)
+
+def ensemble_settings(num_steps, election_names, summary=False, horizons=()):
+    """
+    Returns the settings a checkpointed walk was run with, which a run must
+    share to pick up from its checkpoint.
+    """
+    return {"num_steps": num_steps, "election_names": list(election_names), "summary": summary,
+            "horizons": sorted(h for h in horizons if h < num_steps) if summary else [],
+            "pop_col": POP_COL}
 
-def graph_mm(election, data_dict, initial_mm, steps):
-    plt.figure(figsize=(10, 8))
-    plt.hist(data_dict['mm'], bins=20, color='skyblue', edgecolor='black', alpha=0.7, align='left')
-    plt.title(f"Mean Median Histogram - {election}")
-    plt.xlabel("Mean Median")
-    plt.ylabel("Frequency")
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
+def walk_into_store(random_walk, store, checkpoint_file=None, checkpoint_every=CHECKPOINT_EVERY,
+                    telemetry=None):
+    """
+    Appends the plan stats of every step of the chain to store. If store
+    already holds rows, the chain starts from the last recorded plan, which is
+    not recorded again. Checkpoints save the current plan's assignment and the
+    random state without touching the chain. fast_recom's proposals depend
+    only on those, so a walk resumed from a checkpoint visits the same plans
+    as the uninterrupted one, which in turn visits the same plans with or
+    without checkpoints.
+    """
+    nodes = list(random_walk.initial_state.graph.nodes)
+    resuming = len(store) > 0
+    summary = isinstance(store, EnsembleSummary)
+    plan_stats_row = get_plan_stats_row
+    steps = random_walk
+    if telemetry is not None:
+        plan_stats_row = telemetry.timed("stats", get_plan_stats_row)
+        steps = telemetry.iterate(random_walk, ["population"])
+
+    for step, partition in enumerate(steps):
+        if resuming and step == 0:
+            continue
+        store.append(**plan_stats_row(partition, store.election_names))
+
+        if (checkpoint_file is not None and len(store) % checkpoint_every == 0
+                and len(store) < store.num_steps):
+            store.flush()
+            codes, labels = checkpoint.encode_assignment(partition, nodes)
+            checkpoint.save_checkpoint(checkpoint_file,
+                                       {"kind": "ensemble", "step": len(store),
+                                        "checkpoint_every": checkpoint_every,
+                                        "settings": ensemble_settings(store.num_steps,
+                                                                      store.election_names,
+                                                                      summary,
+                                                                      getattr(store, "horizons", ())),
+                                        "plan": (codes, labels),
+                                        "out_dir": store.out_dir,
+                                        "summary": summary,
+                                        # A store on disk is reopened from out_dir and cut
+                                        # back to this step. A summary can't drop the steps
+                                        # it may flush after this checkpoint, so it is saved
+                                        # here whole.
+                                        "store": store if summary or store.out_dir is None else None,
+                                        "rng": checkpoint.rng_state()})
+
+    store.flush()
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+    return store
+
+def resume_ensemble_stats(checkpoint_file, initial_partition, graph, telemetry=None):
+    """
+    Continues a walk checkpointed by collect_ensemble_stats, given the same
+    initial partition and graph, and returns its completed EnsembleStore. The
+    result matches the one the walk would have produced uninterrupted.
+    """
+    state = checkpoint.load_checkpoint(checkpoint_file, "ensemble")
+    nodes = list(initial_partition.graph.nodes)
+    partition = Partition(initial_partition.graph,
+                          dict(zip(nodes, checkpoint.decode_assignment(*state["plan"]))),
+                          initial_partition.updaters, use_default_updaters=False)
+
+    if state["store"] is not None:
+        store = state["store"]
+    else:
+        store = EnsembleStore.load(state["out_dir"], mode="r+")
+        store.truncate(state["step"])
+
+    # The chain's first state is the checkpointed plan, which is already recorded
+    random_walk = execute_random_walk(partition, store.num_steps - state["step"] + 1,
+                                      NUM_GA_DISTS, graph)
+    checkpoint.restore_rng_state(state["rng"])
+    return walk_into_store(random_walk, store, checkpoint_file, state["checkpoint_every"],
+                           telemetry)
+
+def run_chain(initial_partition, num_steps, elections, graph, summary=False, horizons=()):
+    """
+    Runs one chain of num_steps steps and returns its stats in memory, as
+    each of parallel_ensemble's workers does.
+    """
+    random_walk = execute_random_walk(initial_partition, num_steps, NUM_GA_DISTS, graph)
+    return collect_ensemble_stats(random_walk, elections, summary=summary, horizons=horizons)
 
-    plt.axvline(x=initial_mm[0], color='r', linestyle='--', label='Initial Plan')
-    plt.legend()
+def run_ensemble(initial_partition, num_steps, elections, graph, out_dir=None, summary=False,
+                 horizons=()):
+    """
+    Runs NUM_CHAINS chains of num_steps steps and returns their stats in one
+    EnsembleStore, or EnsembleSummary with summary. A single chain runs in
+    this process; several chains run from the same initial partition on a
+    pool of forked processes through parallel_ensemble. A single chain written to out_dir is checkpointed there
+    and picks up from its checkpoint if one is left over from an interrupted
+    run with the same settings; a checkpoint from a run with other settings is
+    discarded and the chain starts over. With TELEMETRY_FILE its phase
+    timings and rejections are written there too.
+    """
+    if NUM_CHAINS > 1:
+        chain = partial(run_chain, elections=elections, graph=graph, summary=summary,
+                        horizons=horizons)
+        return parallel_ensemble.run_parallel_ensemble(NUM_CHAINS, num_steps, initial_partition,
+                                                       elections, chain, NUM_GA_DISTS,
+                                                       seed=SEED, out_dir=out_dir,
+                                                       summary=summary)
+
+    checkpoint_file = None if out_dir is None else os.path.join(out_dir, CHECKPOINT_FILE)
+    telemetry = None
+    if TELEMETRY_FILE is not None and out_dir is not None:
+        telemetry = ChainTelemetry(run=out_dir)
+
+    try:
+        if checkpoint_file is not None and os.path.exists(checkpoint_file):
+            state = checkpoint.load_checkpoint(checkpoint_file, "ensemble")
+            settings = ensemble_settings(num_steps, [election.name for election in elections],
+                                         summary, horizons)
+            if state.get("settings") == settings:
+                print(f"Resuming chain from {checkpoint_file}", flush=True)
+                return resume_ensemble_stats(checkpoint_file, initial_partition, graph, telemetry)
+            print(f"Starting over: {checkpoint_file} is from a run with other settings", flush=True)
+            os.remove(checkpoint_file)
+
+        random_walk = execute_random_walk(initial_partition, num_steps, NUM_GA_DISTS, graph)
+        return collect_ensemble_stats(random_walk, elections, out_dir, checkpoint_file,
+                                      CHECKPOINT_EVERY, summary=summary, horizons=horizons, telemetry=telemetry)
+    finally:
+        # Also written when a proposal fails, which is when the counts matter most
+        if telemetry is not None:
+            telemetry.write(os.path.join(out_dir, TELEMETRY_FILE))
 
-    plt.savefig(generate_output_fname(election, steps, "mm_histogram"))
-    plt.close()
+# -------------------------- Main Function ---------------------------
+def run_ensembles(initial_partition, elections, ga_graph):
+    """
+    Runs the ensembles set up by the constants above from a loaded graph and
+    initial partition, saves them under ENSEMBLE_DIR and renders their figures
+    to FIGURE_DIR. batch_runner.py calls this once per ensemble experiment
+    with the constants overridden, sharing one graph and partition.
+    """
+    # Plotting is only imported once figures are rendered, so workers that
+    # import this module to run chains stay headless
+    import report
 
-def graph_d_vs_r_wins(election, data_dict, initial_d_wins, initial_r_wins, steps):
-    plt.figure(figsize=(10, 8))
-    plt.hist(data_dict['d_wins'], bins=20, color='lightblue', edgecolor='black', alpha=0.7, align='left', label='Democratic')
-    plt.hist(data_dict['r_wins'], bins=20, color='salmon', edgecolor='black', alpha=0.7, align='left', label='Republican')
-    plt.title(f"Districts Won by Party Histogram - {election}")
-    plt.xlabel("Number of Districts Won")
-    plt.ylabel("Frequency")
-    plt.legend()
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
+    #Start timer
+    start_time = time.time()
 
-    plt.axvline(x=initial_d_wins[0], color='b', linestyle='--', label='Initial Plan - Democratic')
-    plt.axvline(x=initial_r_wins[0], color='r', linestyle='--', label='Initial Plan - Republican')
-    plt.legend()
+    if CONVERGENCE_STOPPING:
+        # Stop the chains once R-hat and ESS meet their targets; the report says why they stopped
+        walk = partial(execute_random_walk, num_dist=NUM_GA_DISTS, graph=ga_graph)
+        store, _ = convergence.run_converged_ensemble(initial_partition, elections, walk,
+                                                      get_plan_stats_row, NUM_GA_DISTS,
+                                                      num_chains=CONVERGENCE_CHAINS,
+                                                      max_steps=max(NUM_STEPS), seed=SEED,
+                                                      out_dir=f"{ENSEMBLE_DIR}/converged")
 
-    plt.savefig(generate_output_fname(election, steps, "district_wins_histogram"))
-    plt.close()
+        end_time = time.time()
 
-def graph_cut_edges(election, data_dict, initial_cut_edges, steps):
-    plt.figure(figsize=(10, 8))
-    plt.hist(data_dict['cut_edges'], bins=20, color='skyblue', edgecolor='black', alpha=0.7, align='left')
-    plt.title(f"Cut Edges Histogram - {election}")
-    plt.xlabel("Number of Cut Edges")
-    plt.ylabel("Frequency")
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
+        report.render_report(store.out_dir, output_dir=FIGURE_DIR)
+    elif NESTED_HORIZONS:
+        # Execute one random walk for the longest horizon
+        store = run_ensemble(initial_partition, max(NUM_STEPS), elections, ga_graph,
+                             f"{ENSEMBLE_DIR}/{max(NUM_STEPS)}steps", SUMMARY_ONLY, NUM_STEPS)
 
-    plt.axvline(x=initial_cut_edges[0], color='r', linestyle='--', label='Initial Plan')
-    plt.legend()
+        end_time = time.time()
 
-    plt.savefig(generate_output_fname(election, steps, "cut_edges_histogram"))
-    plt.close()
+        # Each shorter horizon is a prefix of the same chain(s)
+        report.render_report(store.out_dir, NUM_STEPS, output_dir=FIGURE_DIR)
+    else:
+        stores = []
+        for steps in NUM_STEPS:
 
-def graph_num_majority_black(election, data_dict, initial_num_majority_black, steps):
+            # Execute random walk and gather data for every election
+            stores.append(run_ensemble(initial_partition, steps, elections, ga_graph,
+                                       f"{ENSEMBLE_DIR}/{steps}steps", SUMMARY_ONLY))
 
-    plt.figure(figsize=(10, 8))
-    num_majority_black_values = data_dict['num_majority_black']
-    min_value = min(num_majority_black_values)
-    max_value = max(num_majority_black_values)
-    bin_range = (min_value - 0.5, max_value + 0.5)  # Adjust the range to include all values
-    num_bins = max_value - min_value + 1  # Set the number of bins to the range of values
+            # Measure execution time
+            end_time = time.time()
 
-    plt.hist(num_majority_black_values, bins=num_bins, range=bin_range, color='skyblue', edgecolor='black', alpha=0.7, rwidth=0.8, align='mid')
-    plt.title(f"Majority Black Districts - {election}")
-    plt.xlabel("Number of Districts")
-    plt.ylabel("Frequency")
-    plt.grid(axis='y', linestyle='--', alpha=0.7)
-    plt.xticks(range(min_value, max_value + 1))  # Set x-ticks to integer values
-
-    plt.axvline(x=initial_num_majority_black, color='r', linestyle='--', label='Initial Plan')
-    plt.legend()
-
-    plt.savefig(generate_output_fname(election, steps, "num_majority_black"))
-    plt.close()
+        # Rendering reads the saved stores, so it isn't part of the sampling time
+        for steps, store in zip(NUM_STEPS, stores):
+            report.render_report(store.out_dir, [steps], output_dir=FIGURE_DIR)
+    print("The time of execution of the program is:", (end_time - start_time) / 60, "mins")
 
-# -------------------------- Main Function ---------------------------
 def main():
     # Load graph
-    ga_graph = load_graph("./GA_clean.json")
-
-    #Start timer
-    start_time = time.time()
+    ga_graph = load_graph(GRAPH_PATH)
 
     # Define elections
-    """
-    Elections from GA_clean.json:
-        "G18GOVRKEM": 193,
-        "G18GOVDABR": 309,
-        "G18ATGRCAR": 206,
-        "G18ATGDBAI": 301,
-        "G18AGRRBLA": 210,
-        "G18AGRDSWA": 295,
-    """
-    elections = [
-        Election("G18GOV", {"Democratic": "G18GOVDABR", "Republican": "G18GOVRKEM"}),
-        Election("G18ATG", {"Democratic": "G18ATGDBAI", "Republican": "G18ATGRCAR"}),
-        Election("G18AGR", {"Democratic": "G18AGRDSWA", "Republican": "G18AGRRBLA"}),
-    ]
+    elections = build_elections()
 
     # Create initial partition
     initial_partition = initialize_partition(elections, ga_graph)
 
-    initial_plan_dict = {}
-
-    for election in elections:
-        initial_plan_stats = get_plan_stats(DATA_DICT_FORMAT.copy(), initial_partition, election.name)
-        initial_plan_dict[election.name] = initial_plan_stats
-
-
-
-    for steps in NUM_STEPS:
-
-        # Execute random walk
-        random_walk = execute_random_walk(initial_partition, steps, NUM_GA_DISTS, ga_graph)
-
-        # Gather data for each election
-        election_data_dict = {}
-
-        for election in elections:
-            election_data_dict[election.name] = DATA_DICT_FORMAT.copy()
-
-        for election, data_dict in election_data_dict.items():
-        # for election in elections:
-            for partition in random_walk:
-                # data_dict = get_plan_stats(data_dict, partition, election)
-                #election_data_dict[election] = data_dict
-                data_dict['eg'].append(efficiency_gap(partition[election]))
-                data_dict['mm'].append(mean_median(partition[election]))
-                data_dict['d_wins'].append(partition[election].wins("Democratic"))
-                data_dict['r_wins'].append(partition[election].wins("Republican"))
-                data_dict['cut_edges'].append(len(partition["cut_edges"]))
-                data_dict["dem_vote_share_pd"].append(sorted(partition[election].percents("Democratic"))) # --> Gives a list with the percent vote share in each district
-                data_dict["num_majority_black"].append(partition["majority_bvap_districts"])
-
-
-        # Plot histograms
-        for election, data_dict in election_data_dict.items():
-
-            graph_marginal_box_plots(data_dict["dem_vote_share_pd"], election, steps)
-
-            graph_eg(election, data_dict, initial_plan_dict[election]["eg"], steps)
-
-            graph_mm(election, data_dict, initial_plan_dict[election]["mm"], steps)
-
-            graph_d_vs_r_wins(election, data_dict, initial_plan_dict[election]["d_wins"], initial_plan_dict[election]["r_wins"], steps)
-
-            graph_cut_edges(election, data_dict, initial_plan_dict[election]["cut_edges"], steps)
-
-            graph_num_majority_black(election, data_dict, initial_plan_dict[election]["num_majority_black"][0], steps)
-
-        # Measure execution time
-        end_time = time.time()
-    print("The time of execution of the program is:", (end_time - start_time) / 60, "mins")
+    run_ensembles(initial_partition, elections, ga_graph)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,16 +1,20 @@
-from gerrychain import (GeographicPartition, Partition, Graph, MarkovChain,
-                        proposals, updaters, constraints, accept, Election)
-from gerrychain.proposals import recom, propose_random_flip
-from functools import (partial, reduce)
+from gerrychain import Partition, MarkovChain, constraints, accept
+from fast_recom import fast_recom
+from functools import partial
+import multiprocessing
 import numpy as np
 import random
+import checkpoint
+from tally_engine import DistrictTallyEngine
+from telemetry import ChainTelemetry, plain_updaters
+from plan_hash import ZobristHash, VisitedPlans
 
 
 def config_markov_chain(initial_part, iters=1000, epsilon=0.05, 
-                        compactness=True, pop="TOT_POP", accept_func=None):
+                        compactness=True, pop="TOT_POP", accept_func=None, telemetry=None):
     ideal_population = np.nansum(list(initial_part["population"].values())) / len(initial_part)
 
-    proposal = partial(recom,
+    proposal = partial(fast_recom,
                        pop_col=pop,
                        pop_target=ideal_population,
                        epsilon=epsilon,
@@ -27,9 +31,178 @@ def config_markov_chain(initial_part, iters=1000, epsilon=0.05,
 
     if accept_func == None: accept_func = accept.always_accept
 
-    return MarkovChain(proposal=proposal, constraints=cs,
-                       accept=accept_func, initial_state=initial_part,
-                       total_steps=iters)
+    chain = MarkovChain(proposal=proposal, constraints=cs,
+                        accept=accept_func, initial_state=initial_part,
+                        total_steps=iters)
+    # With telemetry the chain is only instrumented while it is iterated
+    if telemetry is not None:
+        return telemetry.iterate(chain, ["population", "compactness"][:len(cs)])
+    return chain
+
+
+
+def num_cut_edges(part):
+    return len(part["cut_edges"])
+
+
+
+class BurstEngine:
+    """
+    BurstEngine class
+
+    The ReCom chain setup of a Gingleator, built once from its initial plan so bursts only
+    swap in their starting plan.  The ideal population, the recom proposal, the population
+    constraint and the compactness bound are computed up front, with the compactness bound
+    pinned to twice the initial plan's cut edges rather than re-anchored at every burst's
+    starting plan, so it can't drift upward over a run.
+    """
+
+    def __init__(self, initial_part, epsilon=0.05, pop="TOT_POP", compactness=True):
+        ideal_population = np.nansum(list(initial_part["population"].values())) / len(initial_part)
+
+        self.proposal = partial(fast_recom,
+                                pop_col=pop,
+                                pop_target=ideal_population,
+                                epsilon=epsilon,
+                                node_repeats=1)
+
+        cs = [constraints.within_percent_of_ideal_population(initial_part, epsilon)]
+        self.constraint_names = ["population"]
+        if compactness:
+            cs.append(constraints.UpperBound(num_cut_edges, 2*len(initial_part["cut_edges"])))
+            self.constraint_names.append("compactness")
+
+        self.chain = MarkovChain(proposal=self.proposal, constraints=cs,
+                                 accept=accept.always_accept, initial_state=initial_part,
+                                 total_steps=0)
+
+
+    def run(self, start_part, iters, accept_func=None, telemetry=None):
+        """
+        run: returns the engine's markov chain set to take iters steps from start_part (which
+             it yields first), using accept_func or always accepting.  The same chain object
+             is reused by every call, so a chain must be finished before the next one starts.
+             With a telemetry.ChainTelemetry, returns an iterator over the chain that keeps it
+             instrumented until it finishes (see ChainTelemetry.iterate).
+        """
+        self.chain.initial_state = start_part
+        self.chain.total_steps = iters
+        self.chain.accept = accept.always_accept if accept_func is None else accept_func
+        if telemetry is None:
+            return self.chain
+        return telemetry.iterate(self.chain, self.constraint_names)
+
+
+
+def tally_ratio(part, tally_col, numerator, denominator):
+    """
+    tally_ratio: partition updater returning the ratio of two columns of the DistrictTallyEngine
+                 installed under tally_col, as a NumPy array over its districts.
+    """
+    return part[tally_col].ratio(numerator, denominator)
+
+
+
+class MinorityPercUpdater:
+    """
+    MinorityPercUpdater class
+
+    Partition updater mapping each district to its minority population over its
+    total population. The district sums come from a DistrictTallyEngine
+    installed under tally_col, which only applies the deltas of each step's
+    flipped nodes. A plan with a parent starts from a copy of the parent's
+    (cached) percentages and recomputes only the districts the step's flips
+    moved nodes into or out of, which for ReCom is two of them.
+    """
+
+    def __init__(self, minority_pop_col, total_pop_col, alias, tally_col):
+        self.minority_pop_col = minority_pop_col
+        self.total_pop_col = total_pop_col
+        self.alias = alias
+        self.tally_col = tally_col
+
+
+    def __call__(self, part):
+        tallies = part[self.tally_col]
+        label_index = tallies.engine.label_index
+        if part.parent is None or part.flips is None:
+            touched = part.parts.keys()
+            percs = {}
+        else:
+            touched = part.flows.keys()
+            percs = part.parent[self.alias].copy()
+
+        minority_pop = tallies[self.minority_pop_col]
+        total_pop = tallies[self.total_pop_col]
+        for k in touched:
+            percs[k] = float(minority_pop[label_index[k]] / total_pop[label_index[k]])
+        return percs
+
+
+
+# Per-process copy of the Gingleator set up once by _init_burst_worker, so each
+# worker unpickles the graph and updaters a single time for the whole run.
+_burst_worker = {}
+
+
+def burst_seed(seed, burst_round, burst_id):
+    """
+    burst_seed: returns the seed of one burst of a parallel short burst run.  It depends only
+                on the run's seed and the burst's round and position, so a run is reproducible
+                however bursts land on workers.
+    """
+    return int(np.random.SeedSequence([seed, burst_round, burst_id]).generate_state(1)[0])
+
+
+def _init_burst_worker(gingleator):
+    _burst_worker["gingleator"] = gingleator
+    _burst_worker["nodes"] = list(gingleator.part.graph.nodes)
+
+
+def _run_burst(job):
+    start_labels, seed, num_steps, maximize, secondary_scores, profile, beta = job
+    gingles = _burst_worker["gingleator"]
+    nodes = _burst_worker["nodes"]
+    gingles.start_run()
+    random.seed(seed)
+    np.random.seed(seed)
+    telemetry = ChainTelemetry() if profile else None
+    score_part, observe = gingles._timed_scoring(telemetry)
+
+    # With beta, the burst is a Metropolis chain accepting a plan whose score is worse by
+    # delta with probability exp(-beta * delta)
+    metropolis_acceptance_function = None
+    if beta is not None:
+        sign = 1 if maximize else -1
+        def metropolis_acceptance_function(part):
+            if part.parent == None: return True
+            delta = sign * (score_part(part.parent) - score_part(part))
+            if delta <= 0: return True
+            else: return random.random() < np.exp(-beta * delta)
+
+    start = gingles.plan_from_labels(start_labels, nodes)
+    max_part = (start, gingles.score_part(start))
+    part, part_score = max_part
+    observed_num_ops = gingles.observation_array((num_steps,), secondary_scores)
+    plan_hashes = []
+
+    chain = gingles.burst_engine.run(start, num_steps, accept_func=metropolis_acceptance_function,
+                                     telemetry=telemetry)
+    # A chain yields its initial state even when set to take no steps, which a burst of
+    # num_steps=0 doesn't observe; it then ends where it started
+    for j, part in zip(range(num_steps), chain):
+        part_score = score_part(part)
+        observed_num_ops[j] = observe(part, part_score, secondary_scores)
+        plan_hashes.append(part["plan_hash"])
+        if maximize:
+            max_part = (part, part_score) if part_score >= max_part[1] else max_part
+        else:
+            max_part = (part, part_score) if part_score <= max_part[1] else max_part
+
+    # The chain's last plan is where a tempering replica carries on from
+    return ([max_part[0].assignment[node] for node in nodes], max_part[1], observed_num_ops,
+            None if telemetry is None else telemetry.to_dict(),
+            [part.assignment[node] for node in nodes], part_score, plan_hashes)
 
 
 
@@ -38,18 +211,26 @@ class Gingleator:
     Gingleator class
 
     This class represents a set of methods used to find plans with greater numbers
-    of gingles districts.
+    of gingles districts.  Plans are hashed incrementally (plan_hash.ZobristHash) so
+    that a revisited plan is not scored again and can be told apart from new ones, and
+    after every run explored holds how many steps it took and how many distinct plans it
+    visited.
     """
 
     def __init__(self, initial_partition, threshold=0.4, 
                  score_funct=None, minority_perc_col=None,
                  pop_col="TOTPOP", epsilon=0.05):
         self.part = initial_partition
+        self.part.updaters["plan_hash"] = ZobristHash(self.part.graph, sorted(self.part.parts.keys()))
+        self.visited_plans = VisitedPlans()
+        self.scores = {}
+        self.explored = None
         self.threshold = threshold
         self.score = self.num_opportunity_dists if score_funct == None else score_funct
         self.minority_perc = minority_perc_col
         self.pop_col = pop_col
         self.epsilon = epsilon
+        self.burst_engine = BurstEngine(initial_partition, epsilon=epsilon, pop=pop_col)
 
 
     def init_minority_perc_col(self, minority_pop_col, total_pop_col,
@@ -58,14 +239,96 @@ class Gingleator:
          init_minority_prec_col takes the string corresponding to the minority
          population column and the total population column attributes in the 
          partition updaters as well as the desired name of the minority percent 
-         column and updates the partition updaters accordingly
+         column and updates the partition updaters accordingly. The percentages
+         are kept incrementally by a MinorityPercUpdater, and as a NumPy array
+         under the "<minority_perc_col>_array" column for the score functions.
         """
-        perc_up = {minority_perc_col:
-                   lambda part: {k: part[minority_pop_col][k] / part[total_pop_col][k]
-                                 for k in part.parts.keys()}}
+        tally_col = "{}_tallies".format(minority_perc_col)
+        array_col = "{}_array".format(minority_perc_col)
+        district_labels = sorted(self.part.parts.keys())
+        perc_up = {tally_col:
+                   DistrictTallyEngine(self.part.graph, [minority_pop_col, total_pop_col],
+                                       district_labels, alias=tally_col),
+                   minority_perc_col:
+                   MinorityPercUpdater(minority_pop_col, total_pop_col, minority_perc_col,
+                                       tally_col),
+                   array_col:
+                   partial(tally_ratio, tally_col=tally_col, numerator=minority_pop_col,
+                           denominator=total_pop_col)}
         self.part.updaters.update(perc_up)
 
 
+    def score_part(self, part, score_funct=None, threshold=None):
+        """
+        score_part: returns the score of a partition, computing it at most once per plan in a
+                    run.  Scores are cached on the instance, keyed by the plan's hash, the
+                    score function, minority percent column and threshold, and the cache is
+                    emptied when a run starts.  Uses the instance's score function and
+                    threshold unless others are given.
+        """
+        score_funct = self.score if score_funct is None else score_funct
+        threshold = self.threshold if threshold is None else threshold
+        key = (part["plan_hash"], score_funct, self.minority_perc, threshold)
+        score = self.scores.get(key)
+        if score is None:
+            score = score_funct(part, self.minority_perc, threshold)
+            self.scores[key] = score
+        return score
+
+
+    def start_run(self):
+        """
+        start_run: forgets the plans visited and the scores cached by the previous run, so
+                   neither grows past the length of one run.
+        """
+        self.visited_plans.start_run()
+        self.scores = {}
+
+
+    def observation_array(self, shape, secondary_scores=None):
+        """
+        observation_array: returns the zeroed array a run method records its observed scores
+                           in.  With secondary scores each observation gets a trailing axis,
+                           holding the primary score in column 0 and then one column per
+                           (score function, threshold) pair in secondary_scores.
+        """
+        if not secondary_scores:
+            return np.zeros(shape)
+        return np.zeros(shape + (1 + len(secondary_scores),))
+
+
+    def observe(self, part, part_score, secondary_scores=None):
+        """
+        observe: returns the observation of a partition given its primary score, i.e. the
+                 score itself or, with secondary scores, the row [primary score, secondary
+                 scores...].  A secondary score function of None means the instance's
+                 score function.
+        """
+        if not secondary_scores:
+            return part_score
+        return [part_score] + [self.score_part(part, score_funct, threshold)
+                               for score_funct, threshold in secondary_scores]
+
+
+    def plan_from_labels(self, labels, nodes):
+        """
+        plan_from_labels: returns a partition of the instance's graph, with its updaters, that
+                          assigns nodes[i] to district labels[i].
+        """
+        return Partition(self.part.graph, dict(zip(nodes, labels)),
+                         dict(plain_updaters(self.part.updaters)), use_default_updaters=False)
+
+
+    def _timed_scoring(self, telemetry=None):
+        """
+        _timed_scoring: returns the score_part and observe methods, timed under the "score"
+                        phase of telemetry if one is given.
+        """
+        if telemetry is None:
+            return self.score_part, self.observe
+        return telemetry.timed("score", self.score_part), telemetry.timed("score", self.observe)
+
+
     """
     Types of Markov Chains:
     The following methods are different strategies for searching for the maximal
@@ -73,9 +336,23 @@ class Gingleator:
     """
 
     def short_burst_run(self, num_bursts, num_steps, verbose=False,
-                        maximize=True, tracking_fun=None): #checkpoint_file=None):
-        max_part = (self.part, self.score(self.part, self.minority_perc,
-                    self.threshold)) 
+                        maximize=True, tracking_fun=None, secondary_scores=None,
+                        num_parallel=1, num_workers=None, seed=None,
+                        checkpoint_file=None, checkpoint_every=10, telemetry=None):
+        if num_parallel > 1:
+            if checkpoint_file is not None:
+                raise ValueError("checkpoint_file is not supported when bursts run in parallel")
+            return self.parallel_short_burst_run(num_bursts, num_steps, num_parallel,
+                                                 num_workers=num_workers,
+                                                 seed=0 if seed is None else seed,
+                                                 verbose=verbose, maximize=maximize,
+                                                 tracking_fun=tracking_fun,
+                                                 secondary_scores=secondary_scores,
+                                                 telemetry=telemetry)
+        if seed is not None:
+            random.seed(seed)
+            np.random.seed(seed)
+        max_part = (self.part, self.score_part(self.part)) 
         """
         short_burst_run: preforms a short burst run using the instance's score function.
                          Each burst starts at the best preforming plan of the previous
@@ -86,30 +363,198 @@ class Gingleator:
             verbose:    flag - indicates whether to prints the burst number at the beginning of 
                                each burst
             maximize:   flag - indicates where to prefer plans with higher or lower scores.
-            tracking_fun: Function to save information about each observed plan.
+            tracking_fun: Function to save information about each observed plan.  It is not
+                          called again for plans the run has already visited, unless a
+                          revisited plan ties or beats the best plan so far.
+            secondary_scores: list of (score function, threshold) pairs evaluated on every
+                              observed plan and saved as extra observation columns.  Only
+                              the primary score drives the search.
+            num_parallel: if greater than 1, runs parallel_short_burst_run with this many
+                          bursts per round instead.
+            num_workers:  size of the worker pool of a parallel run (default: every core).
+            seed:         if given, seeds random and np.random before the run, or is the base
+                          seed of a parallel run's bursts (default: the current random state,
+                          or base seed 0 for a parallel run).
+            checkpoint_file:  if given, the run's state is saved there before every
+                              checkpoint_every-th burst and at the end, and
+                              resume_short_burst_run continues it.
+            checkpoint_every: how many bursts to run between checkpoints.
+            telemetry:    a telemetry.ChainTelemetry recording the run's phase timings and
+                          rejections (default: none recorded).
         """
-        observed_num_ops = np.zeros((num_bursts, num_steps))
+        observed_num_ops = self.observation_array((num_bursts, num_steps), secondary_scores)
+        self.start_run()
+        settings = {"num_bursts": num_bursts, "num_steps": num_steps, "maximize": maximize,
+                    "secondary_scores": secondary_scores, "checkpoint_every": checkpoint_every}
+
+        return self._run_bursts(max_part, observed_num_ops, 0, settings, verbose=verbose,
+                                tracking_fun=tracking_fun, checkpoint_file=checkpoint_file,
+                                telemetry=telemetry)
+
+
+    def resume_short_burst_run(self, checkpoint_file, verbose=False, tracking_fun=None,
+                               telemetry=None):
+        """
+        resume_short_burst_run: continues a short_burst_run from the checkpoint it saved in
+                                checkpoint_file, returning the same result the run would have
+                                returned had it not been interrupted.  The Gingleator must be
+                                set up like the one that started the run, and tracking_fun
+                                is restored from the checkpoint if it has a load_state_dict
+                                method.  telemetry records the resumed bursts only.
+        """
+        state = checkpoint.load_checkpoint(checkpoint_file, "short_burst_run")
+        checkpoint.restore_rng_state(state["rng"])
+        if state["tracking"] is not None and tracking_fun is not None:
+            tracking_fun.load_state_dict(state["tracking"])
+        self.start_run()
+        if state.get("visited_plans") is not None:
+            self.visited_plans.load_state_dict(state["visited_plans"])
+        nodes = list(self.part.graph.nodes)
+        max_part = (self.plan_from_labels(checkpoint.decode_assignment(*state["max_part"]), nodes),
+                    state["max_score"])
+
+        return self._run_bursts(max_part, state["observed"], state["burst"], state["settings"],
+                                verbose=verbose, tracking_fun=tracking_fun,
+                                checkpoint_file=checkpoint_file, telemetry=telemetry)
+
+
+    def _run_bursts(self, max_part, observed_num_ops, start_burst, settings, verbose=False,
+                    tracking_fun=None, checkpoint_file=None, telemetry=None):
+        num_bursts, num_steps = settings["num_bursts"], settings["num_steps"]
+        maximize, secondary_scores = settings["maximize"], settings["secondary_scores"]
+        nodes = list(self.part.graph.nodes)
+        score_part, observe = self._timed_scoring(telemetry)
+        track = tracking_fun
+        if telemetry is not None and tracking_fun is not None:
+            track = telemetry.timed("tracking", tracking_fun)
+
+        for i in range(start_burst, num_bursts):
+            if checkpoint_file is not None and i % settings["checkpoint_every"] == 0:
+                self._save_burst_checkpoint(checkpoint_file, max_part, observed_num_ops, i,
+                                            settings, nodes, tracking_fun)
 
-        for i in range(num_bursts):
             if verbose: print("*", end="", flush=True)
-            chain = config_markov_chain(max_part[0], iters=num_steps,
-                                        epsilon=self.epsilon, pop=self.pop_col)
+            chain = self.burst_engine.run(max_part[0], num_steps, telemetry=telemetry)
 
             for j, part in enumerate(chain):
-                part_score = self.score(part, self.minority_perc, self.threshold)
-                observed_num_ops[i][j] = part_score
+                part_score = score_part(part)
+                observed_num_ops[i][j] = observe(part, part_score, secondary_scores)
+                prev_best = max_part[0]
                 if maximize:
                     max_part = (part, part_score) if part_score >= max_part[1] else max_part
                 else:
                     max_part = (part, part_score) if part_score <= max_part[1] else max_part
 
-                if tracking_fun != None: tracking_fun(part, i, j)
+                # A revisited plan is tracked again only when it takes over as the best, so
+                # a tracking_fun ranking plans (e.g. TopKPlans) puts it first like max_part
+                new_plan = self.visited_plans.visit(part["plan_hash"])
+                if track != None and (new_plan or max_part[0] is not prev_best):
+                    track(part, i, j)
+
+        if checkpoint_file is not None:
+            self._save_burst_checkpoint(checkpoint_file, max_part, observed_num_ops, num_bursts,
+                                        settings, nodes, tracking_fun)
+
+        self.explored = self.visited_plans.run_stats()
+        return (max_part, observed_num_ops)
 
+
+    def _save_burst_checkpoint(self, checkpoint_file, max_part, observed_num_ops, burst,
+                               settings, nodes, tracking_fun=None):
+        """
+        Saves the state of a short burst run before burst `burst`: the best plan's assignment,
+        the observations and the random state.  The run itself carries on untouched.
+        fast_recom's proposals depend only on the plan and the random state, so a run resumed
+        from its rebuilt best plan makes exactly the same proposals as the uninterrupted one.
+        A tracking_fun with a state_dict method (e.g. plan_archive.TopKPlans) is saved as well,
+        as are the plans visited so far, which decide where tracking_fun is called.
+        """
+        codes, labels = checkpoint.encode_assignment(max_part[0], nodes)
+        tracking_state = (tracking_fun.state_dict() if hasattr(tracking_fun, "state_dict")
+                          else None)
+        checkpoint.save_checkpoint(checkpoint_file,
+                                   {"kind": "short_burst_run", "burst": burst,
+                                    "max_part": (codes, labels), "max_score": max_part[1],
+                                    "observed": observed_num_ops, "settings": settings,
+                                    "tracking": tracking_state,
+                                    "visited_plans": self.visited_plans.state_dict(),
+                                    "rng": checkpoint.rng_state()})
+
+
+    def parallel_short_burst_run(self, num_bursts, num_steps, num_parallel, num_workers=None,
+                                 seed=0, verbose=False, maximize=True, tracking_fun=None,
+                                 secondary_scores=None, telemetry=None):
+        """
+        parallel_short_burst_run: preforms a population-based short burst run using the
+                                  instance's score function.  Each round launches num_parallel
+                                  bursts from the best preforming plan so far on a pool of worker
+                                  processes, and the best plan across all of them seeds the next
+                                  round.  If there's a tie, the later observed one (within a burst,
+                                  then across bursts in order) is selected.  Burst k of round i is
+                                  seeded with burst_seed(seed, i, k), so the run is reproducible
+                                  regardless of num_workers.
+        args:
+            num_bursts:   how many rounds of bursts to preform
+            num_steps:    how many steps to run an unbiased markov chain for during each burst
+            num_parallel: how many bursts to run from the same plan in each round
+            num_workers:  size of the worker pool (default: every core, at most num_parallel)
+            seed:         base seed the bursts' seeds are derived from
+            verbose:      flag - indicates whether to prints the round number at the beginning
+                                 of each round
+            maximize:     flag - indicates where to prefer plans with higher or lower scores.
+            tracking_fun: not supported, since observed plans stay in the worker processes.
+            secondary_scores: list of (score function, threshold) pairs evaluated on every
+                              observed plan and saved as extra observation columns.  Only
+                              the primary score drives the search.
+            telemetry:    a telemetry.ChainTelemetry the totals of every burst are merged into.
+        returns:
+            (max_part, observed_num_ops) as for short_burst_run, with observed_num_ops of shape
+            (num_bursts, num_parallel, num_steps[, score columns]).
+        """
+        if tracking_fun is not None:
+            raise ValueError("tracking_fun is not supported when bursts run in parallel")
+
+        nodes = list(self.part.graph.nodes)
+        max_part = (self.part, self.score_part(self.part))
+        max_labels = [self.part.assignment[node] for node in nodes]
+        observed_num_ops = self.observation_array((num_bursts, num_parallel, num_steps),
+                                                  secondary_scores)
+        self.start_run()
+
+        if num_workers is None:
+            num_workers = min(num_parallel, multiprocessing.cpu_count())
+
+        # The pool forks even where spawn is the default, so workers inherit the Gingleator
+        # rather than unpickling it: gerrychain's Election updaters can't be pickled
+        with multiprocessing.get_context("fork").Pool(num_workers, initializer=_init_burst_worker,
+                                                      initargs=(self,)) as pool:
+            for i in range(num_bursts):
+                if verbose: print("*", end="", flush=True)
+                jobs = [(max_labels, burst_seed(seed, i, k), num_steps, maximize, secondary_scores,
+                         telemetry is not None, None)
+                        for k in range(num_parallel)]
+
+                improved = False
+                for k, result in enumerate(pool.map(_run_burst, jobs)):
+                    labels, burst_score, observed, burst_telemetry, _, _, plan_hashes = result
+                    observed_num_ops[i][k] = observed
+                    self.visited_plans.visit(plan_hashes)
+                    if burst_telemetry is not None:
+                        telemetry.merge(burst_telemetry)
+                    if (burst_score >= max_part[1]) if maximize else (burst_score <= max_part[1]):
+                        max_labels, max_part = labels, (None, burst_score)
+                        improved = True
+
+                if improved:
+                    max_part = (self.plan_from_labels(max_labels, nodes), max_part[1])
+
+        self.explored = self.visited_plans.run_stats()
         return (max_part, observed_num_ops)
 
 
     def variable_len_short_burst(self, num_iters, stuck_buffer=10,
-                                 maximize=True, verbose=False):
+                                 maximize=True, verbose=False, secondary_scores=None,
+                                 telemetry=None):
         """
         variable_len_short_burst: preforms a variable length short burst run using the instance's 
                                   score function. Each burst starts at the best preforming plan of 
@@ -122,21 +567,27 @@ class Gingleator:
             verbose:        flag - indicates whether to prints the burst number at the beginning 
                                     of each burst
             maximize:       flag - indicates where to prefer plans with higher or lower scores.
+            secondary_scores: list of (score function, threshold) pairs evaluated on every
+                              observed plan and saved as extra observation columns.  Only
+                              the primary score drives the search.
+            telemetry:      a telemetry.ChainTelemetry recording the run's phase timings and
+                            rejections (default: none recorded).
         """
-        max_part = (self.part, self.score(self.part, self.minority_perc,
-                        self.threshold))
-        observed_num_ops = np.zeros(num_iters)
+        max_part = (self.part, self.score_part(self.part))
+        observed_num_ops = self.observation_array((num_iters,), secondary_scores)
+        score_part, observe = self._timed_scoring(telemetry)
+        self.start_run()
         time_stuck = 0
         burst_len = 2
         i = 0
 
         while(i < num_iters):
             if verbose: print("*", end="", flush=True)
-            chain = config_markov_chain(max_part[0], iters=burst_len,
-                                        epsilon=self.epsilon, pop=self.pop_col)
+            chain = self.burst_engine.run(max_part[0], burst_len, telemetry=telemetry)
             for j, part in enumerate(chain):
-                part_score = self.score(part, self.minority_perc, self.threshold)
-                observed_num_ops[i] = part_score
+                part_score = score_part(part)
+                observed_num_ops[i] = observe(part, part_score, secondary_scores)
+                self.visited_plans.visit(part["plan_hash"])
 
                 if part_score <= max_part[1]: time_stuck += 1
                 else: time_stuck = 0
@@ -150,10 +601,193 @@ class Gingleator:
                 if i >= num_iters: break
             if time_stuck >= stuck_buffer*burst_len : burst_len *= 2
 
+        self.explored = self.visited_plans.run_stats()
         return (max_part, observed_num_ops)
 
 
-    def biased_run(self, num_iters, p=0.25, maximize=True, verbose=False):
+    def bandit_short_burst_run(self, num_iters, burst_lens=(10, 25, 50, 100, 200),
+                               exploration=0.1, maximize=True, verbose=False,
+                               secondary_scores=None, telemetry=None):
+        """
+        bandit_short_burst_run: preforms a short burst run that chooses each burst's length
+                                online, treating the burst lengths as the arms of a bandit.  An
+                                arm's reward is how much its bursts improved the best score per
+                                step taken, and each burst uses the arm with the highest upper
+                                confidence bound (UCB1 over steps) after every arm is tried once.
+                                Each burst starts at the best preforming plan of the previous
+                                burst.  If there's a tie, the later observed one is selected.
+        args:
+            num_iters:    the total number of steps to take (aka plans to sample)
+            burst_lens:   the burst lengths to choose from
+            exploration:  weight of the confidence bonus, in score units per step.  Larger
+                          values spread the budget more evenly across the burst lengths.
+            maximize:     flag - indicates where to prefer plans with higher or lower scores.
+            verbose:      flag - indicates whether to prints the burst number at the beginning
+                                 of each burst
+            secondary_scores: list of (score function, threshold) pairs evaluated on every
+                              observed plan and saved as extra observation columns.  Only
+                              the primary score drives the search.
+            telemetry:    a telemetry.ChainTelemetry recording the run's phase timings and
+                          rejections (default: none recorded).
+        returns:
+            (max_part, observed_num_ops, arms), where observed_num_ops has one observation per
+            step as for variable_len_short_burst and arms reports the burst lengths used:
+            "burst_lens", and per length the "bursts" run, "steps" taken and total "gains"
+            in the best score, plus the "schedule" of each burst's length in order.
+        """
+        max_part = (self.part, self.score_part(self.part))
+        observed_num_ops = self.observation_array((num_iters,), secondary_scores)
+        score_part, observe = self._timed_scoring(telemetry)
+        self.start_run()
+        sign = 1 if maximize else -1
+
+        bursts = np.zeros(len(burst_lens), dtype=int)
+        steps = np.zeros(len(burst_lens), dtype=int)
+        gains = np.zeros(len(burst_lens))
+        schedule = []
+        i = 0
+
+        while(i < num_iters):
+            if verbose: print("*", end="", flush=True)
+            untried = np.flatnonzero(bursts == 0)
+            if len(untried) > 0:
+                arm = untried[0]
+            else:
+                ucb = gains / steps + exploration * np.sqrt(np.log(steps.sum()) / steps)
+                arm = int(np.argmax(ucb))
+
+            start_score = max_part[1]
+            taken = 0
+            chain = self.burst_engine.run(max_part[0], burst_lens[arm], telemetry=telemetry)
+            for part in chain:
+                part_score = score_part(part)
+                observed_num_ops[i] = observe(part, part_score, secondary_scores)
+                self.visited_plans.visit(part["plan_hash"])
+                if maximize:
+                    max_part = (part, part_score) if part_score >= max_part[1] else max_part
+                else:
+                    max_part = (part, part_score) if part_score <= max_part[1] else max_part
+
+                i += 1
+                taken += 1
+                if i >= num_iters: break
+
+            bursts[arm] += 1
+            steps[arm] += taken
+            gains[arm] += sign * (max_part[1] - start_score)
+            schedule.append(burst_lens[arm])
+
+        arms = {"burst_lens": list(burst_lens), "bursts": bursts, "steps": steps, "gains": gains,
+                "schedule": np.array(schedule)}
+        self.explored = self.visited_plans.run_stats()
+        return (max_part, observed_num_ops, arms)
+
+
+    def parallel_tempering_run(self, num_rounds, num_steps, ps=(0.05, 0.1, 0.2, 0.4),
+                               num_workers=None, seed=0, maximize=True, verbose=False,
+                               secondary_scores=None, telemetry=None):
+        """
+        parallel_tempering_run: preforms a parallel tempering (replica exchange) search using the
+                                instance's score function.  Replica r is a Metropolis chain
+                                tilted by exp(beta[r] * score) with beta[r] = -ln(ps[r]): it
+                                always accepts a plan scoring the same or better and accepts one
+                                scoring worse by delta with probability exp(-beta[r] * delta),
+                                i.e. ps[r] for a unit score drop.  The acceptance is not
+                                corrected for ReCom's proposal probabilities, so the tilt is
+                                relative to the ReCom chain's own distribution.  Each round every
+                                replica takes num_steps steps
+                                from where it left off, on a pool of worker processes, and then
+                                neighboring replicas (pairs starting at 0 in even rounds and at
+                                1 in odd rounds) swap plans with probability
+                                min(1, exp((beta[r] - beta[r+1]) * (score[r+1] - score[r]))).
+                                Hot replicas (large p) cross plateaus and hand better plans down
+                                to cold ones (small p), which climb from them.  The best plan of
+                                any replica is kept; if there's a tie, the later observed one
+                                (within a replica, then across replicas in order) is selected.
+                                Replica r's chain in round i is seeded with
+                                burst_seed(seed, i, r) and swaps are drawn from a generator
+                                seeded with seed, so the run is reproducible regardless of
+                                num_workers.
+        args:
+            num_rounds:   how many rounds of replica steps and swaps to preform
+            num_steps:    how many steps each replica takes per round
+            ps:           each replica's probability of accepting a plan scoring one worse, in
+                          (0, 1]; neighboring entries swap plans, so order them by temperature
+            num_workers:  size of the worker pool (default: every core, at most len(ps))
+            seed:         base seed the replicas' seeds are derived from
+            maximize:     flag - indicates where to prefer plans with higher or lower scores.
+            verbose:      flag - indicates whether to prints the round number at the beginning
+                                 of each round
+            secondary_scores: list of (score function, threshold) pairs evaluated on every
+                              observed plan and saved as extra observation columns.  Only
+                              the primary score drives the search.
+            telemetry:    a telemetry.ChainTelemetry the totals of every replica are merged into.
+        returns:
+            (max_part, observed_num_ops, swaps), where observed_num_ops has shape
+            (num_rounds, len(ps), num_steps[, score columns]) and swaps reports, per neighboring
+            pair of replicas, the swaps "attempted" and "accepted" along with the "ps" and
+            "betas" used.
+        """
+        if not all(0 < p <= 1 for p in ps):
+            raise ValueError("every p in ps must be in (0, 1]")
+
+        nodes = list(self.part.graph.nodes)
+        num_replicas = len(ps)
+        betas = -np.log(np.asarray(ps, dtype=float))
+        sign = 1 if maximize else -1
+        swap_rng = np.random.default_rng(seed)
+
+        max_part = (self.part, self.score_part(self.part))
+        max_labels = [self.part.assignment[node] for node in nodes]
+        replicas = [(max_labels, max_part[1])] * num_replicas
+        observed_num_ops = self.observation_array((num_rounds, num_replicas, num_steps),
+                                                  secondary_scores)
+        attempted = np.zeros(num_replicas - 1, dtype=int)
+        accepted = np.zeros(num_replicas - 1, dtype=int)
+        self.start_run()
+
+        if num_workers is None:
+            num_workers = min(num_replicas, multiprocessing.cpu_count())
+
+        # Workers inherit the Gingleator through fork, as for parallel_short_burst_run
+        with multiprocessing.get_context("fork").Pool(num_workers, initializer=_init_burst_worker,
+                                                      initargs=(self,)) as pool:
+            for i in range(num_rounds):
+                if verbose: print("*", end="", flush=True)
+                jobs = [(labels, burst_seed(seed, i, r), num_steps, maximize, secondary_scores,
+                         telemetry is not None, beta)
+                        for r, ((labels, _), beta) in enumerate(zip(replicas, betas))]
+
+                improved = False
+                for r, result in enumerate(pool.map(_run_burst, jobs)):
+                    (labels, replica_score, observed, replica_telemetry, last_labels, last_score,
+                     plan_hashes) = result
+                    observed_num_ops[i][r] = observed
+                    self.visited_plans.visit(plan_hashes)
+                    replicas[r] = (last_labels, last_score)
+                    if replica_telemetry is not None:
+                        telemetry.merge(replica_telemetry)
+                    if (replica_score >= max_part[1]) if maximize else (replica_score <= max_part[1]):
+                        max_labels, max_part = labels, (None, replica_score)
+                        improved = True
+
+                if improved:
+                    max_part = (self.plan_from_labels(max_labels, nodes), max_part[1])
+
+                for r in range(i % 2, num_replicas - 1, 2):
+                    attempted[r] += 1
+                    log_ratio = (betas[r] - betas[r + 1]) * sign * (replicas[r + 1][1] - replicas[r][1])
+                    if np.log(swap_rng.random()) < log_ratio:
+                        replicas[r], replicas[r + 1] = replicas[r + 1], replicas[r]
+                        accepted[r] += 1
+
+        swaps = {"ps": list(ps), "betas": betas, "attempted": attempted, "accepted": accepted}
+        self.explored = self.visited_plans.run_stats()
+        return (max_part, observed_num_ops, swaps)
+
+
+    def biased_run(self, num_iters, p=0.25, maximize=True, verbose=False,
+                   secondary_scores=None, telemetry=None):
         """
         biased_run: preforms a biased (or tilted) run using the instance's score function.  The
                     chain always accepts a new proposal with the same or a better score and accepts
@@ -164,36 +798,45 @@ class Gingleator:
             verbose:    flag - indicates whether to prints the burst number at the beginning 
                                     of each burst
             maximize:   flag - indicates where to prefer plans with higher or lower scores.
+            secondary_scores: list of (score function, threshold) pairs evaluated on every
+                              observed plan and saved as extra observation columns.  Only
+                              the primary score drives the search.
+            telemetry:  a telemetry.ChainTelemetry recording the run's phase timings and
+                        rejections (default: none recorded).
         """
-        max_part = (self.part, self.score(self.part, self.minority_prec,
-                    self.threshold))
-        observed_num_ops = np.zeros(num_iters)
+        max_part = (self.part, self.score_part(self.part))
+        observed_num_ops = self.observation_array((num_iters,), secondary_scores)
+        score_part, observe = self._timed_scoring(telemetry)
+        self.start_run()
         
         def biased_acceptance_function(part):
             if part.parent == None: return True
-            part_score = self.score(part, self.minority_perc, self.threshold)
-            prev_score = self.score(part.parent, self.minority_perc, self.threshold)
+            part_score = score_part(part)
+            prev_score = score_part(part.parent)
             if maximize and part_score >= prev_score: return True
             elif not maximize and part_score <= prev_score: return True
             else: return random.random() < p
 
-        chain = config_markov_chain(self.part, iters=num_iters,
-                                    epsilon=self.epsilon, pop=self.pop_col,
-                                    accept_func= biased_acceptance_function)
+        chain = self.burst_engine.run(self.part, num_iters,
+                                      accept_func=biased_acceptance_function,
+                                      telemetry=telemetry)
         for i, part in enumerate(chain):
             if verbose and i % 100 == 0: print("*", end="", flush=True)
-            part_score = self.score(part, self.minority_perc, self.threshold)
-            observed_num_ops[i] = part_score
+            part_score = score_part(part)
+            observed_num_ops[i] = observe(part, part_score, secondary_scores)
+            self.visited_plans.visit(part["plan_hash"])
             if maximize:
                 max_part = (part, part_score) if part_score >= max_part[1] else max_part
             else:
                 max_part = (part, part_score) if part_score <= max_part[1] else max_part
 
+        self.explored = self.visited_plans.run_stats()
         return (max_part, observed_num_ops)
 
 
     def biased_short_burst_run(self, num_bursts, num_steps, p=0.25, 
-                              verbose=False, maximize=True):
+                              verbose=False, maximize=True, secondary_scores=None,
+                              telemetry=None):
         """
         biased_short_burst_run: preforms a biased short burst run using the instance's score function.
                                 Each burst is a biased run markov chain, starting at the best preforming 
@@ -206,47 +849,69 @@ class Gingleator:
             verbose:    flag - indicates whether to prints the burst number at the beginning of 
                                each burst
             maximize:   flag - indicates where to prefer plans with higher or lower scores.
+            secondary_scores: list of (score function, threshold) pairs evaluated on every
+                              observed plan and saved as extra observation columns.  Only
+                              the primary score drives the search.
+            telemetry:  a telemetry.ChainTelemetry recording the run's phase timings and
+                        rejections (default: none recorded).
         """
-        max_part = (self.part, self.score(self.part, self.minority_perc,
-                    self.threshold)) 
-        observed_num_ops = np.zeros((num_bursts, num_steps))
+        max_part = (self.part, self.score_part(self.part)) 
+        observed_num_ops = self.observation_array((num_bursts, num_steps), secondary_scores)
+        score_part, observe = self._timed_scoring(telemetry)
+        self.start_run()
 
         def biased_acceptance_function(part):
             if part.parent == None: return True
-            part_score = self.score(part, self.minority_perc, self.threshold)
-            prev_score = self.score(part.parent, self.minority_perc, self.threshold)
+            part_score = score_part(part)
+            prev_score = score_part(part.parent)
             if maximize and part_score >= prev_score: return True
             elif not maximize and part_score <= prev_score: return True
             else: return random.random() < p
 
         for i in range(num_bursts):
             if verbose: print("Burst:", i)
-            chain = config_markov_chain(max_part[0], iters=num_steps,
-                                        epsilon=self.epsilon, pop=self.pop_col,
-                                        accept_func= biased_acceptance_function)
+            chain = self.burst_engine.run(max_part[0], num_steps,
+                                          accept_func=biased_acceptance_function,
+                                          telemetry=telemetry)
 
             for j, part in enumerate(chain):
-                part_score = self.score(part, self.minority_perc, self.threshold)
-                observed_num_ops[i][j] = part_score
+                part_score = score_part(part)
+                observed_num_ops[i][j] = observe(part, part_score, secondary_scores)
+                self.visited_plans.visit(part["plan_hash"])
                 if maximize:
                     max_part = (part, part_score) if part_score >= max_part[1] else max_part
                 else:
                     max_part = (part, part_score) if part_score <= max_part[1] else max_part
     
+        self.explored = self.visited_plans.run_stats()
         return (max_part, observed_num_ops)
 
     """
     Score Functions
     """
 
+    @classmethod
+    def dist_percs(cls, part, minority_perc):
+        """
+        dist_percs: given a partition and name of the minority percent updater, returns the
+                    minority percentage of every district as a NumPy array.  Uses the array
+                    column set up by init_minority_perc_col when there is one.
+        """
+        array_col = "{}_array".format(minority_perc)
+        if array_col in part.updaters:
+            return part[array_col]
+        percs = part[minority_perc]
+        return np.fromiter(percs.values(), dtype=np.float64, count=len(percs))
+
+
     @classmethod
     def num_opportunity_dists(cls, part, minority_perc, threshold):
         """
         num_opportunity_dists: given a partition, name of the minority percent updater, and a
                                threshold, returns the number of opportunity districts.
         """
-        dist_precs = part[minority_perc].values()
-        return sum(list(map(lambda v: v >= threshold, dist_precs)))
+        dist_percs = cls.dist_percs(part, minority_perc)
+        return np.count_nonzero(dist_percs >= threshold)
 
 
     @classmethod
@@ -256,9 +921,10 @@ class Gingleator:
                              threshold, returns the number of opportunity districts + the 
                              percentage of the next highest district.
         """
-        dist_percs = part[minority_perc].values()
-        num_opport_dists = sum(list(map(lambda v: v >= threshold, dist_percs)))
-        next_dist = max(i for i in dist_percs if i < threshold)
+        dist_percs = cls.dist_percs(part, minority_perc)
+        opport = dist_percs >= threshold
+        num_opport_dists = np.count_nonzero(opport)
+        next_dist = dist_percs[~opport].max()
         return num_opport_dists + next_dist
 
 
@@ -271,9 +937,10 @@ class Gingleator:
                                    the distance that district is from the threshold is scaled between 0 
                                    and 1 and added to the count of opportunity districts.
         """
-        dist_precs = part[minority_perc].values()
-        num_opport_dists = sum(list(map(lambda v: v >= threshold, dist_precs)))
-        next_dist = max(i for i in dist_precs if i < threshold)
+        dist_percs = cls.dist_percs(part, minority_perc)
+        opport = dist_percs >= threshold
+        num_opport_dists = np.count_nonzero(opport)
+        next_dist = dist_percs[~opport].max()
 
         if next_dist < threshold - 0.1:
             return num_opport_dists
@@ -288,12 +955,12 @@ class Gingleator:
                                threshold, returns the number of opportunity districts + 
                                (1 - the maximum excess) scaled to between 0 and 1.
         """
-        dist_precs = part[minority_perc].values()
-        num_opportunity_dists = sum(list(map(lambda v: v >= threshold, dist_precs)))
+        dist_percs = cls.dist_percs(part, minority_perc)
+        num_opportunity_dists = np.count_nonzero(dist_percs >= threshold)
         if num_opportunity_dists == 0:
             return 0
         else:
-            max_dist = max(dist_precs)
+            max_dist = dist_percs.max()
             return num_opportunity_dists + (1 - max_dist)/(1 - threshold)
 
 
@@ -304,11 +971,11 @@ class Gingleator:
                                threshold, returns the number of opportunity districts + 
                                (1 - the average excess) scaled to between 0 and 1.
         """
-        dist_precs = part[minority_perc].values()
-        opport_dists = list(filter(lambda v: v >= threshold, dist_precs))
-        if opport_dists == []:
+        dist_percs = cls.dist_percs(part, minority_perc)
+        opport_dists = dist_percs[dist_percs >= threshold]
+        if opport_dists.size == 0:
             return 0
         else:
-            num_opportunity_dists = len(opport_dists)
-            avg_opportunity_dist = np.mean(opport_dists)
-            return num_opportunity_dists + (1 - avg_opportunity_dist)/(1 - threshold)
\ No newline at end of file
+            num_opportunity_dists = opport_dists.size
+            avg_opportunity_dist = opport_dists.mean()
+            return num_opportunity_dists + (1 - avg_opportunity_dist)/(1 - threshold)
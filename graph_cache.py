@@ -0,0 +1,274 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+from gerrychain import Graph
+
+# Bump when the on-disk layout changes so old caches are rebuilt.
+CACHE_VERSION = 2
+META_FILE = "meta.json"
+
+
+class GraphArrays:
+    """
+    GraphArrays class
+
+    The typed, memory-mapped contents of a graph cache. The adjacency is stored
+    in CSR form (indptr/indices over node positions, neighbors in the order of
+    the JSON file), node attributes as one NumPy column each, and edge
+    attributes as columns aligned with indices. String columns such as CD are
+    stored as integer codes into categories[name]. A column missing on some
+    nodes has a boolean mask in present[name].
+    """
+
+    def __init__(self, cache_dir, meta, mmap_mode="r"):
+        def load(name):
+            return np.load(os.path.join(cache_dir, f"{name}.npy"), mmap_mode=mmap_mode)
+
+        self.cache_dir = cache_dir
+        self.graph_attrs = meta["graph"]
+        self.node_ids = load("node_ids")
+        self.indptr = load("indptr")
+        self.indices = load("indices")
+        self.node_columns = {name: load(f"node_{name}") for name in meta["node_columns"]}
+        self.edge_columns = {name: load(f"edge_{name}") for name in meta["edge_columns"]}
+        self.present = {name: load(f"present_{name}") for name in meta["sparse_columns"]}
+        self.categories = meta["categories"]
+
+
+    def __len__(self):
+        return len(self.node_ids)
+
+
+    def column(self, name):
+        """
+        Returns a node column, decoding string columns back to their labels.
+        """
+        values = self.node_columns[name]
+        if name in self.categories:
+            return np.asarray(self.categories[name], dtype=object)[values]
+        return values
+
+
+class NodePositions:
+    """
+    NodePositions class
+
+    The array position of each of a graph's nodes, in the graph's node order,
+    for code that keeps per-node data in NumPy arrays. Graphs loaded from
+    GA_clean.json label nodes 0..n-1, so their labels are already positions
+    and are used without a dict lookup per node.
+    """
+
+    def __init__(self, graph):
+        self.nodes = list(graph.nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.nodes_are_positions = self.nodes == list(range(len(self.nodes)))
+
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+    def positions(self, nodes):
+        """
+        Returns the array positions of a collection of nodes.
+        """
+        if self.nodes_are_positions:
+            return np.fromiter(nodes, dtype=np.intp, count=len(nodes))
+        return np.fromiter((self.index[node] for node in nodes), dtype=np.intp, count=len(nodes))
+
+
+    def nodes_at(self, idx):
+        """
+        Returns the nodes at an array of positions, as a list.
+        """
+        if self.nodes_are_positions:
+            return idx.tolist()
+        return [self.nodes[i] for i in idx.tolist()]
+
+
+def cache_dir_for(json_path):
+    return os.path.splitext(json_path)[0] + ".cache"
+
+
+def version_dir_name(sha256):
+    """
+    Returns the name of the cache subdirectory built from a JSON with the
+    given content hash.
+    """
+    return f"v{CACHE_VERSION}-{sha256[:16]}"
+
+
+def file_hash(path):
+    with open(path, "rb") as f_in:
+        return hashlib.sha256(f_in.read()).hexdigest()
+
+
+def _to_column(values):
+    """
+    Returns (array, labels) for a list of node or edge attribute values, where
+    labels is the category list for a string column and None otherwise.
+    """
+    if all(isinstance(v, str) for v in values):
+        labels = sorted(set(values))
+        codes = {label: i for i, label in enumerate(labels)}
+        dtype = np.uint8 if len(labels) <= 256 else np.int32
+        return np.array([codes[v] for v in values], dtype=dtype), labels
+    elif all(isinstance(v, bool) for v in values):
+        return np.array(values, dtype=bool), None
+    elif all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return np.array(values, dtype=np.int64), None
+    return np.array(values, dtype=np.float64), None
+
+
+def build_graph_cache(json_path, cache_dir=None):
+    """
+    Compiles the NetworkX adjacency JSON at json_path into a directory of .npy
+    arrays plus a metadata file holding the JSON's content hash, under
+    cache_dir and named by that hash, and returns its path. Each version is
+    written to a temporary directory and renamed into place, and is never
+    changed afterwards, so concurrent workers never read a half-written or
+    half-deleted cache. Versions built from other contents of the JSON are
+    removed once the new one is in place.
+    """
+    cache_dir = cache_dir_for(json_path) if cache_dir is None else cache_dir
+
+    with open(json_path, "rb") as f_in:
+        raw = f_in.read()
+    data = json.loads(raw)
+
+    nodes = data["nodes"]
+    position = {node["id"]: i for i, node in enumerate(nodes)}
+    arrays = {"node_ids": np.array([node["id"] for node in nodes], dtype=np.int64)}
+    meta = {"version": CACHE_VERSION,
+            "sha256": hashlib.sha256(raw).hexdigest(),
+            "graph": data.get("graph", []),
+            "node_columns": [], "edge_columns": [], "sparse_columns": [],
+            "categories": {}}
+
+    node_keys = list(dict.fromkeys(key for node in nodes for key in node if key != "id"))
+    for key in node_keys:
+        present = np.array([key in node for node in nodes])
+        values = [node[key] for node in nodes if key in node]
+        column, labels = _to_column(values)
+        if not present.all():
+            full = np.zeros(len(nodes), dtype=column.dtype)
+            full[present] = column
+            column = full
+            arrays[f"present_{key}"] = present
+            meta["sparse_columns"].append(key)
+        arrays[f"node_{key}"] = column
+        meta["node_columns"].append(key)
+        if labels is not None:
+            meta["categories"][key] = labels
+
+    adjacency = data["adjacency"]
+    arrays["indptr"] = np.cumsum([0] + [len(nbrs) for nbrs in adjacency]).astype(np.int64)
+    arrays["indices"] = np.array([position[nbr["id"]] for nbrs in adjacency for nbr in nbrs],
+                                 dtype=np.int32)
+    edge_keys = list(dict.fromkeys(key for nbrs in adjacency for nbr in nbrs for key in nbr if key != "id"))
+    for key in edge_keys:
+        column, _ = _to_column([nbr.get(key) for nbrs in adjacency for nbr in nbrs])
+        arrays[f"edge_{key}"] = column
+        meta["edge_columns"].append(key)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=cache_dir, prefix=".tmp_")
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+    with open(os.path.join(tmp_dir, META_FILE), "w") as f_out:
+        json.dump(meta, f_out)
+
+    version = version_dir_name(meta["sha256"])
+    version_dir = os.path.join(cache_dir, version)
+    try:
+        os.rename(tmp_dir, version_dir)
+    except OSError:
+        # Another process installed the same version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Temporary directories (hidden) may belong to other processes' builds
+    for name in os.listdir(cache_dir):
+        if name != version and not name.startswith("."):
+            path = os.path.join(cache_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                # Files of the unversioned layout used before CACHE_VERSION 2
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    return version_dir
+
+
+def load_graph_arrays(json_path, mmap_mode="r"):
+    """
+    Returns the GraphArrays for json_path, (re)building the cache if it is
+    missing or was built from a file with different contents.
+    """
+    cache_dir = os.path.join(cache_dir_for(json_path), version_dir_name(file_hash(json_path)))
+    if not os.path.exists(os.path.join(cache_dir, META_FILE)):
+        cache_dir = build_graph_cache(json_path)
+    try:
+        return open_graph_arrays(cache_dir, mmap_mode)
+    except FileNotFoundError:
+        # The JSON changed while loading and another process removed this version
+        return open_graph_arrays(build_graph_cache(json_path), mmap_mode)
+
+
+def open_graph_arrays(cache_dir, mmap_mode="r"):
+    """
+    Opens the GraphArrays of one built cache version.
+    """
+    with open(os.path.join(cache_dir, META_FILE)) as f_in:
+        meta = json.load(f_in)
+    return GraphArrays(cache_dir, meta, mmap_mode=mmap_mode)
+
+
+def graph_from_arrays(arrays):
+    """
+    Builds a gerrychain Graph from GraphArrays. Nodes and edges are added in
+    the same order Graph.from_json adds them, so neighbor iteration order (and
+    therefore every seeded chain) matches a graph loaded from the JSON.
+    """
+    node_ids = arrays.node_ids.tolist()
+    names = list(arrays.node_columns)
+    columns = []
+    for name in names:
+        values = arrays.column(name).tolist()
+        if name in arrays.present:
+            values = [v if p else None for v, p in zip(values, arrays.present[name].tolist())]
+        columns.append(values)
+
+    graph = Graph()
+    graph.graph.update(arrays.graph_attrs)
+    graph.add_nodes_from((node, {name: value for name, value in zip(names, row)
+                                 if value is not None or name not in arrays.present})
+                         for node, row in zip(node_ids, zip(*columns)))
+
+    sources = np.repeat(np.arange(len(node_ids)), np.diff(arrays.indptr))
+    targets = arrays.indices
+    node_id_array = np.asarray(node_ids, dtype=object)
+    edge_names = list(arrays.edge_columns)
+    edge_values = [arrays.edge_columns[name].tolist() for name in edge_names]
+    graph.add_edges_from((u, v, dict(zip(edge_names, row)))
+                         for u, v, row in zip(node_id_array[sources].tolist(),
+                                              node_id_array[targets].tolist(),
+                                              zip(*edge_values)))
+
+    graph.issue_warnings()
+    return graph
+
+
+def load_graph(json_path):
+    """
+    Loads the graph at json_path through its binary cache. Equivalent to
+    Graph.from_json(json_path), but only the first load after the JSON
+    changes pays for parsing it.
+    """
+    return graph_from_arrays(load_graph_arrays(json_path))
@@ -0,0 +1,67 @@
+import multiprocessing
+import random
+import numpy as np
+from ensemble_store import EnsembleStore
+from ensemble_summary import EnsembleSummary
+
+# The caller's initial partition and chain setup, set by run_parallel_ensemble
+# before its pool forks, so every worker inherits them instead of loading the
+# graph and building the partition again.
+_worker_state = {}
+
+
+def chain_seeds(seed, num_chains):
+    """
+    Returns one reproducible seed per chain, derived from a single base seed so
+    chains get independent random streams.
+    """
+    return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(num_chains)]
+
+
+def _run_chain(job):
+    chain_id, seed = job
+    random.seed(seed)
+    np.random.seed(seed)
+
+    store = _worker_state["run_chain"](_worker_state["initial_partition"],
+                                       _worker_state["num_steps"])
+    return chain_id, seed, store
+
+
+def run_parallel_ensemble(num_chains, num_steps, initial_partition, elections, run_chain,
+                          num_dists, num_workers=None, seed=0, out_dir=None, summary=False):
+    """
+    Runs num_chains independent ReCom chains of num_steps steps from the
+    initial partition on a pool of forked worker processes and merges their
+    stats into one EnsembleStore, in chain order. Each chain's stats are
+    run_chain(initial_partition, num_steps), e.g. gerrychainGA's run_chain
+    with the graph and elections bound, which workers inherit along with the
+    partition. Each chain is seeded from chain_seeds(seed, num_chains), so a
+    run is reproducible regardless of how chains land on workers, and the
+    store records each chain's rows and seed. With summary, run_chain returns
+    EnsembleSummary objects (see collect_ensemble_stats) and the summaries
+    are merged instead.
+    """
+    seeds = chain_seeds(seed, num_chains)
+    jobs = [(chain_id, seeds[chain_id]) for chain_id in range(num_chains)]
+
+    election_names = [election.name for election in elections]
+    if summary:
+        merged = EnsembleSummary(num_chains * num_steps, election_names, num_dists, out_dir=out_dir)
+    else:
+        merged = EnsembleStore(num_chains * num_steps, election_names, num_dists, out_dir=out_dir)
+
+    if num_workers is None:
+        num_workers = min(num_chains, multiprocessing.cpu_count())
+
+    _worker_state.update(initial_partition=initial_partition, run_chain=run_chain,
+                         num_steps=num_steps)
+    try:
+        with multiprocessing.get_context("fork").Pool(num_workers) as pool:
+            for chain_id, chain_seed, store in pool.imap(_run_chain, jobs):
+                merged.extend(store, chain_id=chain_id, seed=chain_seed)
+                print(f"Merged chain {chain_id} ({len(store)} steps)", flush=True)
+    finally:
+        _worker_state.clear()
+
+    return merged
@@ -0,0 +1,200 @@
+import json
+import os
+import numpy as np
+from gerrychain import Partition
+import checkpoint
+
+ARCHIVE_VERSION = 1
+META_FILE = "meta.json"
+PLANS_FILE = "plans.u8"
+INDEX_FILE = "index.bin"
+
+# One index record per archived plan, aligned with the rows of PLANS_FILE
+INDEX_DTYPE = np.dtype([("run", "<i4"), ("rank", "<i2"), ("score", "<f8")])
+
+
+class TopKPlans:
+    """
+    TopKPlans class
+
+    A tracking_fun for the Gingleator run methods that keeps the k best scoring
+    distinct plans seen, encoded as district-code arrays. A plan is only
+    encoded when its score would make the top k, so ordinary steps cost one
+    (memoized) score lookup. Once k plans are held, a plan tying the worst
+    of them is skipped unless it also ties the best, which it then replaces
+    as the run's max_part does. Its state_dict is saved with a run's
+    checkpoints, so a resumed run ends with the same plans.
+    """
+
+    def __init__(self, k, score_fn, nodes, maximize=True):
+        self.k = k
+        self.score_fn = score_fn
+        self.nodes = list(nodes)
+        self.maximize = maximize
+        self.labels = None
+        # (score, codes) pairs, best first
+        self.plans = []
+
+
+    def __call__(self, part, i=None, j=None):
+        score = self.score_fn(part)
+        sign = 1 if self.maximize else -1
+        if (len(self.plans) == self.k and sign * score <= sign * self.plans[-1][0]
+                and sign * score < sign * self.plans[0][0]):
+            return
+
+        codes, labels = checkpoint.encode_assignment(part, self.nodes)
+        if self.labels is None:
+            self.labels = labels
+        self.plans = [plan for plan in self.plans if not np.array_equal(codes, plan[1])]
+
+        # Like the run methods, ties go to the later observed plan, so the best
+        # plan kept is the run's max_part
+        self.plans.insert(0, (score, codes))
+        self.plans.sort(key=lambda plan: -sign * plan[0])
+        del self.plans[self.k:]
+
+
+    def state_dict(self):
+        return {"labels": self.labels, "plans": list(self.plans)}
+
+
+    def load_state_dict(self, state):
+        self.labels = state["labels"]
+        self.plans = list(state["plans"])
+
+
+class PlanArchive:
+    """
+    PlanArchive class
+
+    An append-only archive of plans from many runs in one directory. Each plan
+    is a row of uint8 district codes over the graph's nodes in PLANS_FILE, with
+    its run, rank and score in the matching record of INDEX_FILE, and each
+    run's metadata (e.g. threshold, burst length, seed) in META_FILE. Both
+    binary files are memory-mapped, so scanning the scores of thousands of runs
+    never reads the plans themselves, and a Partition is only rebuilt when
+    asked for. Only one process should write to an archive at a time.
+    """
+
+    def __init__(self, path, nodes=None, labels=None):
+        self.path = path
+        meta_path = os.path.join(path, META_FILE)
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f_in:
+                self.meta = json.load(f_in)
+            if self.meta["version"] != ARCHIVE_VERSION:
+                raise ValueError(f"{path} is a version {self.meta['version']} plan archive")
+        else:
+            if nodes is None or labels is None:
+                raise ValueError(f"{path} does not exist; nodes and labels are needed to create it")
+            os.makedirs(path, exist_ok=True)
+            self.meta = {"version": ARCHIVE_VERSION, "nodes": list(nodes),
+                         "labels": list(labels), "runs": []}
+            self._write_meta()
+            open(os.path.join(path, PLANS_FILE), "ab").close()
+            open(os.path.join(path, INDEX_FILE), "ab").close()
+
+        self.nodes = self.meta["nodes"]
+        self.labels = self.meta["labels"]
+        self.runs = self.meta["runs"]
+
+
+    def _write_meta(self):
+        meta_path = os.path.join(self.path, META_FILE)
+        with open(meta_path + ".tmp", "w") as f_out:
+            json.dump(self.meta, f_out)
+        os.replace(meta_path + ".tmp", meta_path)
+
+
+    def __len__(self):
+        return sum(run["num_plans"] for run in self.runs)
+
+
+    @property
+    def index(self):
+        """
+        The (run, rank, score) record of every archived plan.
+        """
+        if len(self) == 0:
+            return np.zeros(0, dtype=INDEX_DTYPE)
+        return np.memmap(os.path.join(self.path, INDEX_FILE), dtype=INDEX_DTYPE, mode="r",
+                         shape=(len(self),))
+
+
+    @property
+    def plans(self):
+        """
+        The (plans x nodes) uint8 matrix of district codes into labels.
+        """
+        if len(self) == 0:
+            return np.zeros((0, len(self.nodes)), dtype=np.uint8)
+        return np.memmap(os.path.join(self.path, PLANS_FILE), dtype=np.uint8, mode="r",
+                         shape=(len(self), len(self.nodes)))
+
+
+    def find_run(self, **metadata):
+        """
+        Returns the id of the first run whose metadata includes every given
+        key and value, or None.
+        """
+        for run_id, run in enumerate(self.runs):
+            if all(run.get(key) == value for key, value in metadata.items()):
+                return run_id
+        return None
+
+
+    def add_run(self, metadata, plans, labels=None):
+        """
+        Archives the (score, codes) plans of one run, best first (as kept by
+        TopKPlans), and returns the run's id. labels are the district labels
+        the codes index into, if they differ from the archive's.
+        """
+        run_id = len(self.runs)
+        index = np.zeros(len(plans), dtype=INDEX_DTYPE)
+        rows = np.zeros((len(plans), len(self.nodes)), dtype=np.uint8)
+        remap = None
+        if labels is not None and list(labels) != self.labels:
+            remap = np.array([self.labels.index(label) for label in labels], dtype=np.uint8)
+
+        for rank, (score, codes) in enumerate(plans):
+            index[rank] = (run_id, rank, score)
+            rows[rank] = codes if remap is None else remap[codes]
+
+        # Plans and index records go first and the run last, so a crash leaves
+        # at most rows past the end of the archive, which the next run overwrites
+        num_plans = len(self)
+        with open(os.path.join(self.path, PLANS_FILE), "r+b") as f_out:
+            f_out.truncate(num_plans * len(self.nodes))
+            f_out.seek(0, os.SEEK_END)
+            f_out.write(rows.tobytes())
+        with open(os.path.join(self.path, INDEX_FILE), "r+b") as f_out:
+            f_out.truncate(num_plans * INDEX_DTYPE.itemsize)
+            f_out.seek(0, os.SEEK_END)
+            f_out.write(index.tobytes())
+        self.runs.append(dict(metadata, num_plans=len(plans)))
+        self._write_meta()
+        return run_id
+
+
+    def run_plans(self, run_id):
+        """
+        Returns the positions of a run's plans in the archive, best first.
+        """
+        index = self.index
+        return np.flatnonzero(index["run"] == run_id)
+
+
+    def assignment(self, i):
+        """
+        Returns plan i as a dict from node to district label.
+        """
+        return dict(zip(self.nodes, checkpoint.decode_assignment(self.plans[i], self.labels)))
+
+
+    def partition(self, i, graph, updaters=None):
+        """
+        Rebuilds plan i as a Partition of graph with the given updaters.
+        """
+        return Partition(graph, self.assignment(i), updaters)
@@ -0,0 +1,93 @@
+import numpy as np
+from graph_cache import NodePositions
+
+HASH_SEED = 0  # Seed of the Zobrist keys, so a plan hashes the same in every process
+
+
+class ZobristHash:
+    """
+    ZobristHash class
+
+    Partition updater giving each plan a 64-bit Zobrist hash: the XOR of one
+    random key per (node, district) pair in the plan. A plan with a parent
+    starts from the parent's (cached) hash and XORs in the old and new keys
+    of the step's flipped nodes only, so hashing a ReCom step costs about as
+    much as the two districts it redraws. Equal plans get equal hashes, and
+    distinct plans collide with probability about 2^-64.
+    """
+
+    def __init__(self, graph, district_labels, alias="plan_hash", seed=HASH_SEED):
+        self.alias = alias
+        self.node_positions = NodePositions(graph)
+        self.nodes = self.node_positions.nodes
+        self.label_index = {label: i for i, label in enumerate(district_labels)}
+        rng = np.random.default_rng(seed)
+        self.keys = rng.integers(0, 2**64, size=(len(self.nodes), len(self.label_index)),
+                                 dtype=np.uint64)
+
+
+    def __call__(self, partition):
+        parent = partition.parent
+        if parent is None or partition.flips is None:
+            labels = [self.label_index[partition.assignment[node]] for node in self.nodes]
+            return int(np.bitwise_xor.reduce(self.keys[np.arange(len(self.nodes)), labels]))
+
+        flips = partition.flips
+        idx = self.node_positions.positions(flips.keys())
+        old = [self.label_index[parent.assignment[node]] for node in flips]
+        new = [self.label_index[label] for label in flips.values()]
+        return parent[self.alias] ^ int(np.bitwise_xor.reduce(self.keys[idx, old] ^ self.keys[idx, new]))
+
+
+class VisitedPlans:
+    """
+    VisitedPlans class
+
+    The hashes of the plans visited in the current run, which tell new plans
+    from repeats and give the run's number of distinct plans.
+    """
+
+    def __init__(self):
+        self.visited = set()
+        self.steps = 0
+
+
+    def visit(self, plan_hashes):
+        """
+        Records one step of the run per plan hash and returns whether the last
+        one is a plan the run had not visited before.
+        """
+        if isinstance(plan_hashes, int):
+            plan_hashes = [plan_hashes]
+        new = False
+        for plan_hash in plan_hashes:
+            new = plan_hash not in self.visited
+            self.visited.add(plan_hash)
+            self.steps += 1
+        return new
+
+
+    def start_run(self):
+        """
+        Forgets the plans visited by the previous run.
+        """
+        self.visited = set()
+        self.steps = 0
+
+
+    def run_stats(self):
+        """
+        Returns the current run's steps, distinct plans visited and repeated
+        plans.
+        """
+        return {"steps": self.steps, "distinct_plans": len(self.visited),
+                "repeats": self.steps - len(self.visited)}
+
+
+    def state_dict(self):
+        return {"visited": set(self.visited), "steps": self.steps}
+
+
+    def load_state_dict(self, state):
+        self.visited = set(state["visited"])
+        self.steps = state["steps"]
@@ -0,0 +1,249 @@
+import argparse
+import multiprocessing
+import os
+import matplotlib
+matplotlib.use("Agg")
+from matplotlib.figure import Figure
+from matplotlib import cbook
+import numpy as np
+from ensemble_store import EnsembleStore
+from ensemble_summary import EnsembleSummary, SUMMARY_FILE
+
+OUTPUT_DIR = "./output"
+FIGURES = ["district_vs_boxplot", "eg_histogram", "mm_histogram", "district_wins_histogram",
+           "cut_edges_histogram", "num_majority_black"]
+
+
+def generate_output_fname(election, num_steps, metric, output_dir=OUTPUT_DIR):
+    steps_dir = f"{output_dir}/{num_steps}steps"
+    os.makedirs(steps_dir, exist_ok=True)
+    return f"{steps_dir}/{election}_{metric}.png"
+
+
+def load_ensemble(store_dir):
+    """
+    Opens the EnsembleStore or EnsembleSummary saved in store_dir.
+    """
+    if os.path.exists(os.path.join(store_dir, SUMMARY_FILE)):
+        return EnsembleSummary.load(store_dir)
+    return EnsembleStore.load(store_dir)
+
+
+def store_figure_data(store, election, steps):
+    """
+    Returns the figure data of one election over the first `steps` steps of
+    an EnsembleStore: its stats, no weights (every row counts once), and the
+    initial plan's stats, which every chain records as its first row. The
+    vote shares are reduced to the box plot stats of each sorted district.
+    """
+    data_dict = store.election_data(election, stop=steps)
+    initial = {key: values[0] for key, values in data_dict.items()}
+    data_dict["dem_vote_share_pd"] = cbook.boxplot_stats(np.asarray(data_dict["dem_vote_share_pd"]))
+    return data_dict, {}, initial
+
+
+def summary_figure_data(summary, election, steps):
+    """
+    Returns the figure data of one election over the first `steps` steps of
+    an EnsembleSummary, like store_figure_data, with each sketch's values
+    weighted by their counts.
+    """
+    sketches = summary.sketches_at(steps)
+    e = summary.election_names.index(election)
+    data_dict, weights = {}, {}
+    for key in ["eg", "mm", "d_wins", "r_wins"]:
+        data_dict[key], weights[key] = sketches[key].samples(e)
+    for key in ["cut_edges", "num_majority_black"]:
+        data_dict[key], weights[key] = sketches[key].samples(0)
+    data_dict["dem_vote_share_pd"] = [sketches["dem_vote_share_pd"].box_stats(e * summary.num_dists + d)
+                                      for d in range(summary.num_dists)]
+
+    initial = {key: summary.initial[key][e] for key in ["eg", "mm", "d_wins", "r_wins", "dem_vote_share_pd"]}
+    initial["cut_edges"] = summary.initial["cut_edges"]
+    initial["num_majority_black"] = summary.initial["num_majority_black"]
+    return data_dict, weights, initial
+
+# ------------------- Graphing Fns ------------------------
+def graph_marginal_box_plots(box_stats, initial_vote_shares, election, steps, fname):
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+
+    # Draw 50% line
+    ax.axhline(0.5, color="#cccccc")
+
+    # Draw boxplot
+    ax.bxp(box_stats, positions=range(len(box_stats)))
+
+    # Draw initial plan's Democratic vote %s
+    ax.plot(initial_vote_shares, "ro")
+
+    # Annotate
+    ax.set_title(f"{election} election vote shares ({steps} Steps)")
+    ax.set_ylabel("Democratic vote %")
+    ax.set_xlabel("Sorted districts")
+    ax.set_ylim(0, 1)
+    ax.set_yticks([0, 0.25, 0.5, 0.75, 1])
+
+    fig.savefig(fname)
+
+def graph_eg(election, data_dict, initial_eg, fname, weights=None):
+    if weights is None:
+        weights = {}
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    ax.hist(data_dict['eg'], weights=weights.get('eg'), bins=20, color='skyblue', edgecolor='black', alpha=0.7, align='left')
+    ax.set_title(f"Efficiency Gap Histogram - {election}")
+    ax.set_xlabel("Efficiency Gap")
+    ax.set_ylabel("Frequency")
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+    ax.axvline(x=initial_eg, color='r', linestyle='--', label='Initial Plan')
+    ax.legend()
+
+    fig.savefig(fname)
+
+def graph_mm(election, data_dict, initial_mm, fname, weights=None):
+    if weights is None:
+        weights = {}
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    ax.hist(data_dict['mm'], weights=weights.get('mm'), bins=20, color='skyblue', edgecolor='black', alpha=0.7, align='left')
+    ax.set_title(f"Mean Median Histogram - {election}")
+    ax.set_xlabel("Mean Median")
+    ax.set_ylabel("Frequency")
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+    ax.axvline(x=initial_mm, color='r', linestyle='--', label='Initial Plan')
+    ax.legend()
+
+    fig.savefig(fname)
+
+def graph_d_vs_r_wins(election, data_dict, initial_d_wins, initial_r_wins, fname, weights=None):
+    if weights is None:
+        weights = {}
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    ax.hist(data_dict['d_wins'], weights=weights.get('d_wins'), bins=20, color='lightblue', edgecolor='black', alpha=0.7, align='left', label='Democratic')
+    ax.hist(data_dict['r_wins'], weights=weights.get('r_wins'), bins=20, color='salmon', edgecolor='black', alpha=0.7, align='left', label='Republican')
+    ax.set_title(f"Districts Won by Party Histogram - {election}")
+    ax.set_xlabel("Number of Districts Won")
+    ax.set_ylabel("Frequency")
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+    ax.axvline(x=initial_d_wins, color='b', linestyle='--', label='Initial Plan - Democratic')
+    ax.axvline(x=initial_r_wins, color='r', linestyle='--', label='Initial Plan - Republican')
+    ax.legend()
+
+    fig.savefig(fname)
+
+def graph_cut_edges(election, data_dict, initial_cut_edges, fname, weights=None):
+    if weights is None:
+        weights = {}
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    ax.hist(data_dict['cut_edges'], weights=weights.get('cut_edges'), bins=20, color='skyblue', edgecolor='black', alpha=0.7, align='left')
+    ax.set_title(f"Cut Edges Histogram - {election}")
+    ax.set_xlabel("Number of Cut Edges")
+    ax.set_ylabel("Frequency")
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+
+    ax.axvline(x=initial_cut_edges, color='r', linestyle='--', label='Initial Plan')
+    ax.legend()
+
+    fig.savefig(fname)
+
+def graph_num_majority_black(election, data_dict, initial_num_majority_black, fname, weights=None):
+    if weights is None:
+        weights = {}
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    num_majority_black_values = data_dict['num_majority_black']
+    min_value = int(min(num_majority_black_values))
+    max_value = int(max(num_majority_black_values))
+    bin_range = (min_value - 0.5, max_value + 0.5)  # Adjust the range to include all values
+    num_bins = max_value - min_value + 1  # Set the number of bins to the range of values
+
+    ax.hist(num_majority_black_values, weights=weights.get('num_majority_black'), bins=num_bins, range=bin_range, color='skyblue', edgecolor='black', alpha=0.7, rwidth=0.8, align='mid')
+    ax.set_title(f"Majority Black Districts - {election}")
+    ax.set_xlabel("Number of Districts")
+    ax.set_ylabel("Frequency")
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    ax.set_xticks(range(min_value, max_value + 1))  # Set x-ticks to integer values
+
+    ax.axvline(x=initial_num_majority_black, color='r', linestyle='--', label='Initial Plan')
+    ax.legend()
+
+    fig.savefig(fname)
+
+# ------------------- Report Stage ------------------------
+def render_figure(job):
+    """
+    Renders one figure of one election at one horizon from the ensemble store
+    saved in store_dir, and returns its file name.
+    """
+    store_dir, election, steps, figure, output_dir = job
+    ensemble = load_ensemble(store_dir)
+    if isinstance(ensemble, EnsembleSummary):
+        data_dict, weights, initial = summary_figure_data(ensemble, election, steps)
+    else:
+        data_dict, weights, initial = store_figure_data(ensemble, election, steps)
+    fname = generate_output_fname(election, steps, figure, output_dir)
+
+    if figure == "district_vs_boxplot":
+        graph_marginal_box_plots(data_dict["dem_vote_share_pd"], initial["dem_vote_share_pd"],
+                                 election, steps, fname)
+    elif figure == "eg_histogram":
+        graph_eg(election, data_dict, initial["eg"], fname, weights)
+    elif figure == "mm_histogram":
+        graph_mm(election, data_dict, initial["mm"], fname, weights)
+    elif figure == "district_wins_histogram":
+        graph_d_vs_r_wins(election, data_dict, initial["d_wins"], initial["r_wins"], fname, weights)
+    elif figure == "cut_edges_histogram":
+        graph_cut_edges(election, data_dict, initial["cut_edges"], fname, weights)
+    elif figure == "num_majority_black":
+        graph_num_majority_black(election, data_dict, initial["num_majority_black"], fname, weights)
+    else:
+        raise ValueError(f"Unknown figure {figure}")
+    return fname
+
+
+def render_report(store_dir, horizons=None, output_dir=OUTPUT_DIR, figures=FIGURES,
+                  num_workers=None):
+    """
+    Renders every figure for each election of the ensemble (an EnsembleStore
+    or EnsembleSummary) saved in store_dir, once per horizon (number of steps,
+    all of them by default), on a pool of worker processes. Only the saved
+    ensemble is read, so a report can be regenerated or restyled without
+    rerunning any chain.
+    """
+    store = load_ensemble(store_dir)
+    if horizons is None:
+        horizons = [len(store) if not store.chains
+                    else max(chain["stop"] - chain["start"] for chain in store.chains)]
+
+    jobs = [(store_dir, election, steps, figure, output_dir)
+            for steps in horizons
+            for election in store.election_names
+            for figure in figures]
+
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    with multiprocessing.Pool(min(num_workers, len(jobs))) as pool:
+        return pool.map(render_figure, jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render the figures of a saved ensemble.")
+    parser.add_argument("store_dir", help="directory of a saved EnsembleStore")
+    parser.add_argument("--steps", type=int, nargs="*", default=None,
+                        help="horizons to plot (default: the full chain)")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    fnames = render_report(args.store_dir, args.steps, args.output_dir, num_workers=args.workers)
+    print(f"Rendered {len(fnames)} figures", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,16 @@
+import json
+import multiprocessing
+import os
+import random
 import numpy as np
-import pickle
-from gerrychain import Graph, Partition, Election, updaters
+from gerrychain import Partition, Election, updaters
 from gerrychain.updaters import Tally, cut_edges
 from gingleator import Gingleator
+from plan_archive import PlanArchive, TopKPlans
+import graph_cache
 
-score_functs = {0: None, 
-                1: Gingleator.reward_partial_dist, 
+score_functs = {0: None,
+                1: Gingleator.reward_partial_dist,
                 2: Gingleator.reward_next_highest_close,
                 3: Gingleator.penalize_maximum_over,
                 4: Gingleator.penalize_avg_over,
@@ -21,10 +26,22 @@ SCORE_FUNCT = score_functs[5]
 EPS = 0.045
 THRESHOLDS = [0.5, 0.45, 0.4]
 MIN_POP_COL = "BVAP"
-
-print("Reading in Data/Graph", flush=True)
-
-graph = Graph.from_json("./GA_clean.json")
+# Thresholds whose opportunity district counts are recorded on every observed plan,
+# whichever threshold drives the search. Set to [] to skip.
+TRACK_THRESHOLDS = [0.5, 0.45, 0.4]
+
+GRAPH_PATH = "./GA_clean.json"
+OUT_DIR = "./output/short-burst/sb-runs"
+MANIFEST_FILE = "{}/manifest.json".format(OUT_DIR)
+TRACK_DIR = "{}/thresholds".format(OUT_DIR)
+ARCHIVE_DIR = "{}/plans".format(OUT_DIR)  # PlanArchive of every job's best plans
+# Name of each job's output file; the thresholds file gets the same name under TRACK_DIR
+F_OUT_TEMPLATE = ("{out_dir}/GA_dists{num_districts}_{min_pop_col}_opt_{threshold:.1%}_{iters}"
+                  "_sbl{burst_len}_score_{score}_{n}.npy")
+TOP_K = 10  # Distinct best plans archived per job
+NUM_WORKERS = None  # None uses every core
+SEED = 0  # Base seed each job's seed is derived from
+CHECKPOINT_EVERY = 20  # Bursts between checkpoints; an interrupted job resumes from its last one
 
 """
 Elections from GA_clean.json:
@@ -41,47 +58,156 @@ elections = [
     Election("G18AGR", {"Democratic": "G18AGRDSWA", "Republican": "G18AGRRBLA"}),
 ]
 
-my_updaters = {"population": updaters.Tally(POP_COL, alias="population"), 
-        "VAP": Tally("VAP"),
-        "cut_edges": cut_edges, 
-        "BVAP": Tally("BVAP", alias="BVAP")
-    }
-election_updaters = {election.name: election for election in elections}
-my_updaters.update(election_updaters)
-
-initial_partition = Partition(graph, assignment="CD", updaters=my_updaters)
-
-for burst_len in BURST_LENS:
-    for threshold in THRESHOLDS:
-        gingles = Gingleator(initial_partition, pop_col=POP_COL,
-                            threshold=threshold, score_funct=SCORE_FUNCT, epsilon=EPS,
-                            minority_perc_col="{}_perc".format(MIN_POP_COL))
-
-        gingles.init_minority_perc_col(MIN_POP_COL, "VAP", 
-                                    "{}_perc".format(MIN_POP_COL))
-
-        num_bursts = int(ITERS/burst_len)
-
-        print("Starting Short Bursts Runs", flush=True)
-
-        for n in range(N_SAMPS):
-            sb_obs = gingles.short_burst_run(num_bursts=num_bursts, num_steps=burst_len,
-                                            maximize=True, verbose=False)
-            print("\tFinished chain {}".format(n), flush=True)
-
-            print("\tSaving results", flush=True)
-
-            f_out = "./output/short-burst/sb-runs/{}_dists{}_{}_opt_{:.1%}_{}_sbl{}_score_{}_{}.npy".format("GA",
-                                                                NUM_DISTRICTS, MIN_POP_COL, threshold, 
-                                                                ITERS, burst_len, "num_opportunity_dists", n)
-            np.save(f_out, sb_obs[1])
-
-            f_out_part = "./output/short-burst/sb-runs/{}_dists{}_{}_opt_{:.1%}_{}_sbl{}_score_{}_{}_max_part.p".format("GA",
-                                                                NUM_DISTRICTS, MIN_POP_COL, threshold, 
-                                                                ITERS, burst_len, "num_opportunity_dists", n)
-
-            max_stats = {"VAP": sb_obs[0][0]["VAP"],
-                        "BVAP": sb_obs[0][0]["BVAP"]}
-
-            with open(f_out_part, "wb") as f_out:
-                pickle.dump(max_stats, f_out)
\ No newline at end of file
+# Set in the parent before the pool starts, so forked workers share it instead
+# of parsing the graph again. Workers that don't inherit it load it once.
+initial_partition = None
+
+
+def build_initial_partition(graph):
+    my_updaters = {"population": updaters.Tally(POP_COL, alias="population"),
+            "VAP": Tally("VAP"),
+            "cut_edges": cut_edges,
+            "BVAP": Tally("BVAP", alias="BVAP")
+        }
+    election_updaters = {election.name: election for election in elections}
+    my_updaters.update(election_updaters)
+
+    return Partition(graph, assignment="CD", updaters=my_updaters)
+
+
+def score_name():
+    return "num_opportunity_dists" if SCORE_FUNCT is None else SCORE_FUNCT.__name__
+
+
+def output_fnames(threshold, burst_len, n):
+    f_out = F_OUT_TEMPLATE.format(out_dir=OUT_DIR, num_districts=NUM_DISTRICTS,
+                                  min_pop_col=MIN_POP_COL, threshold=threshold, iters=ITERS,
+                                  burst_len=burst_len, score=score_name(), n=n)
+
+    # Kept out of OUT_DIR so globbing the per-run .npy files doesn't pick it up
+    f_out_track = os.path.join(TRACK_DIR, os.path.basename(f_out))
+    return f_out, f_out_track
+
+
+def run_key(job):
+    """
+    Returns the metadata a job's plans are archived under in the plan archive.
+    """
+    return {"state": "GA", "num_districts": NUM_DISTRICTS, "min_pop_col": MIN_POP_COL,
+            "threshold": job["threshold"], "iters": ITERS, "burst_len": job["burst_len"],
+            "score": score_name(), "n": job["n"], "seed": job["seed"]}
+
+
+def build_job_manifest():
+    """
+    Turns the BURST_LENS x THRESHOLDS x N_SAMPS grid into a list of jobs, each
+    with its output files and its own seed. A job's seed depends only on its
+    grid point, so rerunning a job reproduces it.
+    """
+    jobs = []
+    for burst_len in BURST_LENS:
+        for threshold in THRESHOLDS:
+            for n in range(N_SAMPS):
+                f_out, f_out_track = output_fnames(threshold, burst_len, n)
+                seed_seq = np.random.SeedSequence([SEED, burst_len, round(threshold * 1000), n])
+                jobs.append({"burst_len": burst_len, "threshold": threshold, "n": n,
+                             "seed": int(seed_seq.generate_state(1)[0]),
+                             "f_out": f_out,
+                             "f_out_track": f_out_track if TRACK_THRESHOLDS else None})
+    return jobs
+
+
+def job_done(job, archive):
+    return (all(os.path.exists(job[key]) for key in ("f_out", "f_out_track")
+                if job[key] is not None)
+            and archive.find_run(**run_key(job)) is not None)
+
+
+def _init_worker(graph_path):
+    global initial_partition
+    if initial_partition is None:
+        initial_partition = build_initial_partition(graph_cache.load_graph(graph_path))
+
+
+def run_job(job):
+    """
+    Runs one short burst chain and saves its results. Files are written under
+    a temporary name and renamed into place, so a job killed mid-write is not
+    mistaken for a finished one. A job killed mid-run resumes from its last
+    checkpoint and produces the same results. Returns the job with its TOP_K
+    best distinct plans, which the parent process adds to the plan archive.
+    """
+    random.seed(job["seed"])
+    np.random.seed(job["seed"])
+
+    gingles = Gingleator(initial_partition, pop_col=POP_COL,
+                        threshold=job["threshold"], score_funct=SCORE_FUNCT, epsilon=EPS,
+                        minority_perc_col="{}_perc".format(MIN_POP_COL))
+
+    gingles.init_minority_perc_col(MIN_POP_COL, "VAP",
+                                "{}_perc".format(MIN_POP_COL))
+
+    num_bursts = int(ITERS/job["burst_len"])
+
+    secondary_scores = [(Gingleator.num_opportunity_dists, t) for t in TRACK_THRESHOLDS]
+    top_plans = TopKPlans(TOP_K, gingles.score_part, initial_partition.graph.nodes)
+    checkpoint_file = job["f_out"] + ".ckpt"
+    if os.path.exists(checkpoint_file):
+        sb_obs = gingles.resume_short_burst_run(checkpoint_file, tracking_fun=top_plans)
+    else:
+        sb_obs = gingles.short_burst_run(num_bursts=num_bursts, num_steps=job["burst_len"],
+                                        maximize=True, verbose=False, tracking_fun=top_plans,
+                                        secondary_scores=secondary_scores,
+                                        checkpoint_file=checkpoint_file,
+                                        checkpoint_every=CHECKPOINT_EVERY)
+    # Column 0 is the primary score, the rest are the TRACK_THRESHOLDS counts
+    observed = sb_obs[1][..., 0] if secondary_scores else sb_obs[1]
+
+    with open(job["f_out"] + ".tmp", "wb") as f_out:
+        np.save(f_out, observed)
+    if job["f_out_track"] is not None:
+        with open(job["f_out_track"] + ".tmp", "wb") as f_out:
+            np.save(f_out, sb_obs[1][..., 1:])
+        os.replace(job["f_out_track"] + ".tmp", job["f_out_track"])
+
+    os.replace(job["f_out"] + ".tmp", job["f_out"])
+    os.remove(checkpoint_file)
+    job = dict(job, steps=gingles.explored["steps"], distinct_plans=gingles.explored["distinct_plans"])
+    return job, top_plans.plans, top_plans.labels
+
+
+def main():
+    global initial_partition
+
+    print("Reading in Data/Graph", flush=True)
+
+    initial_partition = build_initial_partition(graph_cache.load_graph(GRAPH_PATH))
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+    if TRACK_THRESHOLDS:
+        os.makedirs(TRACK_DIR, exist_ok=True)
+    jobs = build_job_manifest()
+    with open(MANIFEST_FILE, "w") as f_out:
+        json.dump(jobs, f_out, indent=2)
+
+    archive = PlanArchive(ARCHIVE_DIR, nodes=initial_partition.graph.nodes,
+                          labels=sorted(initial_partition.parts.keys()))
+    pending = [job for job in jobs if not job_done(job, archive)]
+    print("Starting Short Bursts Runs: {} of {} jobs left".format(len(pending), len(jobs)), flush=True)
+
+    if not pending:
+        return
+
+    num_workers = NUM_WORKERS if NUM_WORKERS is not None else multiprocessing.cpu_count()
+    with multiprocessing.Pool(min(num_workers, len(pending)), initializer=_init_worker,
+                              initargs=(GRAPH_PATH,)) as pool:
+        for job, plans, labels in pool.imap_unordered(run_job, pending):
+            if archive.find_run(**run_key(job)) is None:
+                archive.add_run(run_key(job), plans, labels)
+            print("\tFinished chain {} (burst length {}, threshold {}): {} distinct plans in {} steps"
+                  .format(job["n"], job["burst_len"], job["threshold"], job["distinct_plans"],
+                          job["steps"]), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import numpy as np
+from graph_cache import NodePositions
+
+
+class DistrictTallyEngine:
+    """
+    DistrictTallyEngine class
+
+    Keeps a plan as an integer assignment array over the graph's nodes and the
+    per-district sums of a set of node columns (population, VAP, BVAP, every
+    election's vote columns) as one (columns x districts) matrix. Installed as
+    a partition updater, it computes the matrix for the initial plan with
+    np.bincount and afterwards only applies the deltas of the nodes each step
+    flipped, so no per-node dict updaters are needed. It must be installed under
+    its alias so a step can find its parent's tallies.
+    """
+
+    def __init__(self, graph, columns, district_labels, elections=(), alias="district_tallies"):
+        self.alias = alias
+        self.node_positions = NodePositions(graph)
+        self.nodes = self.node_positions.nodes
+        self.columns = list(dict.fromkeys(columns))
+        for election in elections:
+            self.columns.extend(c for c in election.columns if c not in self.columns)
+        self.column_index = {column: i for i, column in enumerate(self.columns)}
+        self.labels = list(district_labels)
+        self.label_index = {label: i for i, label in enumerate(self.labels)}
+
+        self.weights = np.array([[graph.nodes[node][column] for node in self.nodes]
+                                 for column in self.columns], dtype=np.float64)
+        # Offsets that give every (column, district) pair its own bincount bin
+        self._bin_offsets = (np.arange(len(self.columns)) * len(self.labels))[:, None]
+
+        # Row indices into the tally matrix of each election's party columns
+        self.election_names = [election.name for election in elections]
+        self.election_parties = [list(election.parties) for election in elections]
+        self.election_columns = np.array([[self.column_index[election.parties_to_columns[party]]
+                                           for party in election.parties]
+                                          for election in elections], dtype=np.intp)
+
+
+    def __call__(self, partition):
+        parent = partition.parent
+        if parent is None or partition.flips is None:
+            assignment = np.fromiter((self.label_index[partition.assignment[node]] for node in self.nodes),
+                                     dtype=np.intp, count=len(self.nodes))
+            return DistrictTallies(self, assignment, self.tally(assignment))
+
+        return parent[self.alias].apply_flips(partition.flips)
+
+
+    def tally(self, assignment):
+        """
+        Returns the (columns x districts) sums for an assignment array.
+        """
+        return np.stack([np.bincount(assignment, weights=w, minlength=len(self.labels))
+                         for w in self.weights])
+
+
+    def delta(self, idx, old, new):
+        """
+        Returns the change in the (columns x districts) sums when the nodes at
+        positions idx move from districts old to districts new.
+        """
+        num_bins = len(self.columns) * len(self.labels)
+        w = self.weights[:, idx].ravel()
+        gained = np.bincount((self._bin_offsets + new).ravel(), weights=w, minlength=num_bins)
+        lost = np.bincount((self._bin_offsets + old).ravel(), weights=w, minlength=num_bins)
+        return (gained - lost).reshape(len(self.columns), len(self.labels))
+
+
+class DistrictTallies:
+    """
+    DistrictTallies class
+
+    The assignment array and district sums of one plan, with the district-level
+    metrics computed as array operations over every election at once.
+    """
+
+    def __init__(self, engine, assignment, sums):
+        self.engine = engine
+        self.assignment = assignment
+        self.sums = sums
+
+
+    def apply_flips(self, flips):
+        """
+        Returns the tallies of the plan obtained by applying flips, updating only
+        the flipped nodes' contribution to the sums.
+        """
+        engine = self.engine
+        idx = engine.node_positions.positions(flips)
+        new = np.fromiter((engine.label_index[label] for label in flips.values()),
+                          dtype=np.intp, count=len(flips))
+        old = self.assignment[idx]
+
+        assignment = self.assignment.copy()
+        assignment[idx] = new
+        return DistrictTallies(engine, assignment, self.sums + engine.delta(idx, old, new))
+
+
+    def __getitem__(self, column):
+        """
+        Returns the per-district sums of one column, ordered like engine.labels.
+        """
+        return self.sums[self.engine.column_index[column]]
+
+
+    def ratio(self, numerator, denominator):
+        return self[numerator] / self[denominator]
+
+
+    def votes(self):
+        """
+        Returns an (elections x parties x districts) array of vote counts.
+        """
+        return self.sums[self.engine.election_columns]
+
+
+    def percents(self, party):
+        """
+        Returns an (elections x districts) array of party's vote share.
+        """
+        votes = self.votes()
+        totals = votes.sum(axis=1)
+        party_idx = [parties.index(party) for parties in self.engine.election_parties]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return votes[np.arange(len(party_idx)), party_idx] / totals
+
+
+    def wins(self, party):
+        """
+        Returns the number of districts party won in each election, where a win
+        means strictly more votes than every other party.
+        """
+        votes = self.votes()
+        party_idx = [parties.index(party) for parties in self.engine.election_parties]
+        party_votes = votes[np.arange(len(party_idx)), party_idx]
+        others = votes.copy()
+        others[np.arange(len(party_idx)), party_idx] = -np.inf
+        return np.count_nonzero(party_votes > others.max(axis=1), axis=1)
+
+
+    def efficiency_gaps(self):
+        """
+        Returns the efficiency gap of every two-party election, positive values
+        favoring the first party listed in the election.
+        """
+        votes = self.votes()
+        first, second = votes[:, 0], votes[:, 1]
+        totals = first + second
+        first_wins = first > second
+        first_waste = np.where(first_wins, first - totals / 2, first)
+        second_waste = np.where(first_wins, second, second - totals / 2)
+        return (second_waste - first_waste).sum(axis=1) / totals.sum(axis=1)
+
+
+    def mean_medians(self):
+        """
+        Returns the mean-median score of every election for its first party.
+        """
+        votes = self.votes()
+        percents = votes[:, 0] / votes.sum(axis=1)
+        return np.median(percents, axis=1) - np.mean(percents, axis=1)
+
+
+    def election_metrics(self):
+        """
+        Returns the efficiency gap, mean-median, seats won by each of the two
+        parties and the first party's sorted district vote shares for every
+        two-party election, computing the vote shares only once.
+        """
+        votes = self.votes()
+        first, second = votes[:, 0], votes[:, 1]
+        totals = first + second
+        shares = np.sort(first / totals, axis=1)
+        num_dists = shares.shape[1]
+        median = (shares[:, (num_dists - 1) // 2] + shares[:, num_dists // 2]) / 2
+
+        first_wins = first > second
+        first_waste = np.where(first_wins, first - totals / 2, first)
+        second_waste = np.where(first_wins, second, second - totals / 2)
+
+        return {"eg": (second_waste - first_waste).sum(axis=1) / totals.sum(axis=1),
+                "mm": median - shares.mean(axis=1),
+                "first_wins": np.count_nonzero(first_wins, axis=1),
+                "second_wins": np.count_nonzero(second > first, axis=1),
+                "first_shares": shares}
@@ -0,0 +1,243 @@
+import contextlib
+import csv
+import json
+import os
+import time
+
+# Phases a chain step's time is split into. Each phase's time excludes the
+# phases nested inside it, e.g. updaters computed while checking constraints.
+PHASES = ["proposal", "constraints", "accept", "updaters", "score", "tracking", "stats"]
+
+
+def constraint_name(constraint):
+    """
+    Returns a short name for a constraint: the name of the function a Bounds
+    constraint checks (e.g. "population"), or else the constraint's own name.
+    """
+    func = getattr(constraint, "func", constraint)
+    while hasattr(func, "func"):
+        func = func.func
+    return getattr(func, "__name__", type(constraint).__name__)
+
+
+class TimedUpdaters(dict):
+    """
+    TimedUpdaters class
+
+    A partition's updaters, each wrapped to time its computation under the
+    "updaters" phase. Partitions proposed from one share their parent's
+    updaters, so wrapping a chain's initial state times the whole chain, and
+    unwrapping them in place with restore stops timing all of it.
+    """
+
+    def __init__(self, updaters, telemetry):
+        super().__init__({key: telemetry.timed("updaters", updater)
+                          for key, updater in updaters.items()})
+        self.original = updaters
+        self.telemetry = telemetry
+
+
+    def restore(self):
+        """
+        Puts the original updaters back in place of their timed versions.
+        """
+        self.clear()
+        self.update(self.original)
+
+
+def plain_updaters(updaters):
+    """
+    Returns updaters without the timing wrappers of a ChainTelemetry.
+    """
+    return updaters.original if isinstance(updaters, TimedUpdaters) else updaters
+
+
+class ChainTelemetry:
+    """
+    ChainTelemetry class
+
+    Per-run profiling of MarkovChain runs. While a chain runs under
+    instrumented (or iterate), its proposal, constraints and acceptance
+    function and its plans' updaters are swapped for timed versions that also
+    count proposal failures, rejections by each constraint and rejections by
+    the acceptance function, and they are all put back once it finishes.
+    Run methods time scoring and tracking through timed. Nothing is wrapped
+    unless a ChainTelemetry is passed, so disabled runs pay nothing. The
+    totals are written with write as one JSON object or CSV row per run.
+    """
+
+    def __init__(self, run=None):
+        self.run = run
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.proposals = 0
+        self.proposal_failures = 0
+        self.constraint_rejections = {}
+        self.accept_rejections = 0
+        self.wall_time = 0.0
+        self._stack = []
+        self._mark = None
+
+
+    def _enter(self, phase):
+        now = time.perf_counter()
+        if self._mark is not None:
+            self.wall_time += now - self._mark
+            if self._stack:
+                self.times[self._stack[-1]] += now - self._mark
+        self._stack.append(phase)
+        self._mark = now
+
+
+    def _exit(self):
+        now = time.perf_counter()
+        self.wall_time += now - self._mark
+        self.times[self._stack.pop()] += now - self._mark
+        self._mark = now
+
+
+    def timed(self, phase, fn):
+        """
+        Returns fn wrapped to add its running time to phase.
+        """
+        def timed_fn(*args, **kwargs):
+            self._enter(phase)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._exit()
+        return timed_fn
+
+
+    @contextlib.contextmanager
+    def instrumented(self, chain, constraint_names=None):
+        """
+        Instruments a MarkovChain in place for the duration of a with block.
+        constraint_names name the chain's constraints in the rejection counts
+        (by default, constraint_name of each). Leaving the block restores the
+        chain's functions, its initial state's updaters and the updaters of
+        every plan it proposed, so nothing the chain returned stays timed.
+        """
+        proposal = chain.proposal
+        is_valid = chain.is_valid
+        accept = chain.accept
+        initial_state = chain.initial_state
+        updaters = initial_state.updaters
+        constraints = list(is_valid.constraints)
+        if constraint_names is None:
+            constraint_names = [constraint_name(constraint) for constraint in constraints]
+        for name in constraint_names:
+            self.constraint_rejections.setdefault(name, 0)
+
+        def timed_proposal(partition):
+            self.proposals += 1
+            self._enter("proposal")
+            try:
+                return proposal(partition)
+            except Exception:
+                self.proposal_failures += 1
+                raise
+            finally:
+                self._exit()
+
+        def timed_is_valid(partition):
+            self._enter("constraints")
+            try:
+                for name, constraint in zip(constraint_names, constraints):
+                    if not constraint(partition):
+                        self.constraint_rejections[name] += 1
+                        return False
+                return True
+            finally:
+                self._exit()
+
+        def timed_accept(partition):
+            self._enter("accept")
+            try:
+                accepted = accept(partition)
+            finally:
+                self._exit()
+            if not accepted:
+                self.accept_rejections += 1
+            return accepted
+
+        timed_updaters = TimedUpdaters(plain_updaters(updaters), self)
+        chain.proposal = timed_proposal
+        chain.is_valid = timed_is_valid
+        chain.accept = timed_accept
+        initial_state.updaters = timed_updaters
+        if self._mark is None:
+            self._mark = time.perf_counter()
+        try:
+            yield chain
+        finally:
+            timed_updaters.restore()
+            initial_state.updaters = updaters
+            chain.proposal = proposal
+            chain.is_valid = is_valid
+            chain.accept = accept
+
+
+    def iterate(self, chain, constraint_names=None):
+        """
+        Yields the plans of a MarkovChain, instrumented (see instrumented)
+        until it finishes or the iteration is abandoned.
+        """
+        with self.instrumented(chain, constraint_names):
+            yield from chain
+
+
+    def merge(self, other):
+        """
+        Adds the totals of another run (a ChainTelemetry or its to_dict) to
+        this one, e.g. the bursts run by worker processes.
+        """
+        other = other.to_dict() if isinstance(other, ChainTelemetry) else other
+        for phase in PHASES:
+            self.times[phase] += other["times"][phase]
+        self.proposals += other["proposals"]
+        self.proposal_failures += other["proposal_failures"]
+        for name, count in other["constraint_rejections"].items():
+            self.constraint_rejections[name] = self.constraint_rejections.get(name, 0) + count
+        self.accept_rejections += other["accept_rejections"]
+        self.wall_time += other["wall_time"]
+
+
+    def to_dict(self):
+        """
+        Returns the run's totals. steps counts the proposals that got past the
+        constraints, i.e. chain steps after the initial state, and other is the
+        time spent outside every phase (e.g. the run method's own loop).
+        """
+        steps = self.proposals - self.proposal_failures - sum(self.constraint_rejections.values())
+        return {"run": self.run,
+                "steps": steps,
+                "proposals": self.proposals,
+                "proposal_failures": self.proposal_failures,
+                "constraint_rejections": dict(self.constraint_rejections),
+                "accept_rejections": self.accept_rejections,
+                "times": dict(self.times),
+                "other": self.wall_time - sum(self.times.values()),
+                "wall_time": self.wall_time}
+
+
+    def write(self, path):
+        """
+        Writes the run's totals to path: a .csv path gets one row appended
+        (with a header if the file is new) and any other path a JSON object.
+        """
+        totals = self.to_dict()
+        if not path.endswith(".csv"):
+            with open(path, "w") as f_out:
+                json.dump(totals, f_out, indent=2)
+            return
+
+        row = {key: value for key, value in totals.items() if not isinstance(value, dict)}
+        row.update({f"rejected_{name}": count
+                    for name, count in totals["constraint_rejections"].items()})
+        row.update({f"{phase}_time": seconds for phase, seconds in totals["times"].items()})
+        new_file = not os.path.exists(path)
+        with open(path, "a", newline="") as f_out:
+            writer = csv.DictWriter(f_out, fieldnames=list(row))
+            if new_file:
+                writer.writeheader()
+            writer.writerow(row)